@@ -21,13 +21,16 @@
 """This is the __init__.py file for pyservice. This will import "service"
 and "handle_cli" for the current platform, otherwise a RuntimeError will
 be raised if the current platform is unsupported.
+
+On Linux "host" is imported as well, it combines several services into a
+single daemon.
 """
 import platform
 
 system = platform.system()
 
 if "Linux" in system:
-    from .linux import service, handle_cli
+    from .linux import service, handle_cli, host
 elif "Windows" in system:
     from .windows import service, handle_cli
 else:
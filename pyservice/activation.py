@@ -0,0 +1,76 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+"""This module obtains the listening socket of services which are started
+on demand.
+
+With activation enabled, the daemon only holds a listening socket and runs
+the business logic of the service in a child process once the first
+connection arrives. The socket is either passed by systemd (socket
+activation, see sd_listen_fds(3)) or bound by us.
+"""
+import os
+import socket
+
+from .utils import bind_unix_socket
+
+# The first file descriptor passed by systemd
+SD_LISTEN_FDS_START = 3
+
+
+def systemd_socket():
+    """Returns the socket passed by systemd, if any.
+
+    The environment variables describing it are removed so that processes
+    we start don't mistake it for their own.
+
+    :returns: The listening socket or None if systemd did not pass one
+    :rtype: socket.socket
+    """
+    if os.environ.get("LISTEN_PID") != str(os.getpid()):
+        return None
+
+    count = int(os.environ.get("LISTEN_FDS", "0"))
+    for name in ("LISTEN_PID", "LISTEN_FDS", "LISTEN_FDNAMES"):
+        os.environ.pop(name, None)
+
+    if count < 1:
+        return None
+    return socket.socket(fileno=SD_LISTEN_FDS_START)
+
+
+def listening_socket(address):
+    """Creates a socket listening on an address.
+
+    :param address: A path for a Unix socket or a (host, port) tuple
+    :type address: str or tuple
+    :returns: The listening socket
+    :rtype: socket.socket
+    """
+    if isinstance(address, str):
+        sock = bind_unix_socket(address)
+    else:
+        family = socket.AF_INET6 if ":" in address[0] else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(address)
+
+    sock.listen(128)
+    return sock
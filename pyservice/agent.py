@@ -0,0 +1,426 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+"""This module implements an agent which controls all services installed on a
+Linux host, and a client to control agents on many hosts at once.
+
+The agent listens on a TCP or Unix socket. A connection carries a single
+batch of requests, each naming a service and an operation (start, stop,
+restart, status, stats or reload), which are run concurrently. Clients
+authenticate with a token shared with the agent: the agent sends a random
+challenge and the client answers with an HMAC of it together with the
+batch, so the batch can't be altered on the way either.
+
+Run an agent with:
+
+.. code:: bash
+
+    $ sudo python -m pyservice.agent serve --listen 0.0.0.0:7300 --token-file /etc/pyservice/agent.token
+
+and control services through it with:
+
+.. code:: bash
+
+    $ python -m pyservice.agent call --agent web1:7300 --agent web2:7300 \\
+          --token-file agent.token restart time_writer tornado_server
+"""
+import os
+import sys
+import hmac
+import json
+import socket
+import hashlib
+import argparse
+import binascii
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from . import control
+
+OPERATIONS = ("start", "stop", "restart", "status", "stats", "reload")
+
+
+def _address(address):
+    """Parses an address given as a path for a Unix socket or as host:port.
+
+    :param address: The address to parse
+    :type address: str
+    :returns: The socket family and the address in the form socket expects
+    :rtype: tuple
+    """
+    if address.startswith("/"):
+        return socket.AF_UNIX, address
+
+    host, port = address.rsplit(":", 1)
+    host = host.strip("[]")
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    return family, (host, int(port))
+
+
+def _sign(token, nonce, requests):
+    """Answers a challenge of the agent, signing the batch of requests
+    along with it.
+
+    :param token: The shared token
+    :param nonce: The challenge sent by the agent
+    :param requests: The batch of requests
+    :type token: str
+    :type nonce: str
+    :type requests: list
+    :rtype: str
+    """
+    batch = json.dumps(requests, sort_keys=True, separators=(",", ":"))
+    message = nonce + "\n" + batch
+    return hmac.new(token.encode("utf-8"), message.encode("utf-8"),
+                    hashlib.sha256).hexdigest()
+
+
+def read_token(path):
+    """Reads the shared token from a file.
+
+    :param path: The file holding the token
+    :type path: str
+    :returns: The token
+    :rtype: str
+    """
+    with open(path) as file:
+        token = file.read().strip()
+    if not token:
+        raise RuntimeError("The token in `%s` is empty" % path)
+    return token
+
+
+class Agent(object):
+    """Serves the lifecycle operations of all services installed on this host.
+    """
+    def __init__(self, address, token, init_directory="/etc/init.d",
+                 run_directory="/var/run", workers=16):
+        """Initializes a new instance of pyservice.agent.Agent.
+
+        :param address: Where to listen, a path or host:port
+        :param token: The token clients have to authenticate with
+        :param init_directory: Where the control scripts are installed
+        :param run_directory: Where the PID files and control sockets are
+        :param workers: How many requests of a batch run at the same time
+        :type address: str
+        :type token: str
+        :type init_directory: str
+        :type run_directory: str
+        :type workers: int
+        """
+        self.address = address
+        self.token = token
+        self.init_directory = init_directory
+        self.run_directory = run_directory
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._socket = None
+
+        # Set once the agent accepts connections, with the address it is
+        # bound to (which tells the port when listening on port 0)
+        self.listening = threading.Event()
+        self.bound_address = None
+
+    def services(self):
+        """Lists the services installed by pyservice on this host.
+
+        :returns: The names of the services
+        :rtype: list
+        """
+        names = []
+        for name in sorted(os.listdir(self.init_directory)):
+            try:
+                with open(os.path.join(self.init_directory, name)) as file:
+                    script = file.read(4096)
+            except (IOError, OSError, UnicodeDecodeError):
+                continue
+            if 'PYTHON_PATH="' in script and 'SERVICE_PATH="' in script:
+                names.append(name)
+        return names
+
+    def serve_forever(self):
+        """Accepts connections until the agent is closed.
+
+        :returns: None
+        :rtype: None
+        """
+        family, address = _address(self.address)
+        if family == socket.AF_UNIX and os.path.exists(address):
+            os.remove(address)
+
+        self._socket = socket.socket(family, socket.SOCK_STREAM)
+        if family != socket.AF_UNIX:
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(address)
+        if family == socket.AF_UNIX:
+            os.chmod(address, 0o600)
+        self._socket.listen(64)
+        self.bound_address = self._socket.getsockname()
+        self.listening.set()
+
+        while self._socket is not None:
+            try:
+                connection, _ = self._socket.accept()
+            except (OSError, AttributeError):
+                return
+
+            thread = threading.Thread(target=self._handle, args=(connection, ))
+            thread.daemon = True
+            thread.start()
+
+    def close(self):
+        """Stops accepting connections.
+
+        :returns: None
+        :rtype: None
+        """
+        sock, self._socket = self._socket, None
+        if sock is not None:
+            # Closing alone does not wake up a thread blocked in accept
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+    def handle(self, service, operation):
+        """Runs a single operation on a service.
+
+        :param service: The name of the service
+        :param operation: One of OPERATIONS
+        :type service: str
+        :type operation: str
+        :returns: The result of the operation
+        :raises RuntimeError: When the operation fails
+        """
+        if operation not in OPERATIONS:
+            raise RuntimeError("Unknown operation: %s" % operation)
+        if service not in self.services():
+            raise RuntimeError("Not installed")
+
+        pid_file = os.path.join(self.run_directory, service + ".pid")
+        control_socket = os.path.join(self.run_directory, service + ".sock")
+
+        if operation == "status":
+            pid = None
+            if os.path.exists(pid_file):
+                with open(pid_file) as file:
+                    pid = int(file.read().strip() or 0) or None
+            return {"running": pid is not None, "pid": pid}
+
+        if operation == "stats":
+            return control.request(control_socket, "status")
+
+        if operation == "reload":
+            return control.request(control_socket, "reload")
+
+        # Starting needs a new daemon, which the control script knows how
+        # to launch (as the right user)
+        process = subprocess.Popen(
+            [os.path.join(self.init_directory, service), operation],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = process.communicate()[0].decode("utf-8", "replace")
+        if process.returncode != 0:
+            raise RuntimeError(output.strip() or "Exited with %d" % process.returncode)
+        return output.strip()
+
+    def _run(self, request):
+        """Runs one request of a batch, turning failures into a result.
+
+        :param request: The request, with `service` and `op` keys
+        :type request: dict
+        :rtype: dict
+        """
+        reply = {"service": request.get("service"), "op": request.get("op")}
+        try:
+            reply["result"] = self.handle(request.get("service"), request.get("op"))
+            reply["ok"] = True
+        except Exception as error:
+            reply["ok"] = False
+            reply["error"] = str(error)
+        return reply
+
+    def _handle(self, connection):
+        """Authenticates a client and runs its batch of requests.
+
+        :param connection: The accepted connection
+        :type connection: socket.socket
+        """
+        try:
+            connection.settimeout(30)
+            nonce = binascii.hexlify(os.urandom(16)).decode("ascii")
+            control.send_message(connection, {"nonce": nonce})
+
+            message = control.read_message(connection)
+            if message is None:
+                return
+            requests = message.get("requests", [])
+            if not isinstance(requests, list) or not hmac.compare_digest(
+                    str(message.get("auth", "")), _sign(self.token, nonce, requests)):
+                control.send_message(connection, {"ok": False, "error": "Authentication failed"})
+                return
+
+            # The batch may take as long as starting or stopping takes
+            connection.settimeout(None)
+            results = list(self._executor.map(self._run, requests))
+            control.send_message(connection, {"ok": True, "results": results})
+        except Exception:
+            # The client went away or sent garbage, nothing to reply to
+            pass
+        finally:
+            connection.close()
+
+
+class AgentClient(object):
+    """Sends batches of requests to an agent.
+    """
+    def __init__(self, address, token, timeout=60):
+        """Initializes a new instance of pyservice.agent.AgentClient.
+
+        :param address: Where the agent listens, a path or host:port
+        :param token: The token shared with the agent
+        :param timeout: Seconds to wait for the agent to finish a batch
+        :type address: str
+        :type token: str
+        :type timeout: float
+        """
+        self.address = address
+        self.token = token
+        self.timeout = timeout
+
+    def call(self, requests):
+        """Sends a batch of requests, which the agent runs concurrently.
+
+        :param requests: Requests as dicts with `service` and `op` keys
+        :type requests: list
+        :returns: One result per request, in the same order
+        :rtype: list
+        """
+        family, address = _address(self.address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(address)
+            challenge = control.read_message(sock)
+            if challenge is None or "nonce" not in challenge:
+                raise RuntimeError("No challenge from %s" % self.address)
+
+            control.send_message(sock, {"auth": _sign(self.token, challenge["nonce"], requests),
+                                        "requests": requests})
+            reply = control.read_message(sock)
+        finally:
+            sock.close()
+
+        if reply is None:
+            raise RuntimeError("Connection closed without a reply")
+        if not reply.get("ok"):
+            raise RuntimeError(reply.get("error", "Unknown error"))
+        return reply["results"]
+
+    def run(self, operation, *services):
+        """Runs the same operation on several services.
+
+        :param operation: One of OPERATIONS
+        :param services: The names of the services
+        :type operation: str
+        :returns: One result per service
+        :rtype: list
+        """
+        return self.call([{"service": name, "op": operation} for name in services])
+
+
+def fan_out(addresses, requests, token, timeout=60):
+    """Sends the same batch of requests to many agents at once.
+
+    :param addresses: Where the agents listen
+    :param requests: Requests as dicts with `service` and `op` keys
+    :param token: The token shared with the agents
+    :param timeout: Seconds to wait for each agent
+    :type addresses: list
+    :type requests: list
+    :type token: str
+    :type timeout: float
+    :returns: Maps each address to its results, or to the exception raised
+        when talking to it
+    :rtype: dict
+    """
+    def call(address):
+        try:
+            return AgentClient(address, token, timeout).call(requests)
+        except Exception as error:
+            return error
+
+    with ThreadPoolExecutor(max_workers=max(min(len(addresses), 64), 1)) as executor:
+        return dict(zip(addresses, executor.map(call, addresses)))
+
+
+def main(argv=None):
+    """Command line interface of the agent, see the module documentation.
+
+    :param argv: A list of arguments in the form of sys.argv (defaults to sys.argv)
+    :type argv: list
+    :rtype: None
+    """
+    argv = sys.argv[1:] if argv is None else argv
+
+    parser = argparse.ArgumentParser(description="Control pyservice services on many hosts.")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    serve = subparsers.add_parser("serve", help="Run the agent of this host")
+    serve.add_argument("--listen", default="127.0.0.1:7300",
+                       help="host:port or path of a Unix socket to listen on")
+    serve.add_argument("--token-file", required=True, help="file holding the shared token")
+
+    call = subparsers.add_parser("call", help="Run an operation through agents")
+    call.add_argument("--agent", action="append", required=True,
+                      help="host:port or path of an agent, may be repeated")
+    call.add_argument("--token-file", required=True, help="file holding the shared token")
+    call.add_argument("--timeout", type=float, default=60)
+    call.add_argument("op", choices=OPERATIONS)
+    call.add_argument("services", nargs="+")
+
+    args = parser.parse_args(argv)
+    token = read_token(args.token_file)
+
+    if args.command == "serve":
+        Agent(args.listen, token).serve_forever()
+        return
+
+    requests = [{"service": name, "op": args.op} for name in args.services]
+    failed = False
+    for address, results in sorted(fan_out(args.agent, requests, token, args.timeout).items()):
+        if isinstance(results, Exception):
+            print('* %s: %s' % (address, results))
+            failed = True
+            continue
+        for result in results:
+            if result["ok"]:
+                print('* %s %s: %s' % (address, result["service"], result["result"]))
+            else:
+                print('* %s %s: failed: %s' % (address, result["service"], result["error"]))
+                failed = True
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
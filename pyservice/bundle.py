@@ -0,0 +1,248 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+"""This module snapshots a service into a self-contained bundle, used by
+`install --bundle`.
+
+A bundle is a directory with a dedicated site directory holding the service
+script and every module outside the standard library it had imported at
+install time, compiled ahead of time into hash checked bytecode. A small
+bootstrap script puts that site directory in front of `sys.path` and runs
+the service, with the interpreter started with -I (no environment, no user
+site). Nothing is looked up on a long `sys.path` or compiled (into a
+directory the service user can't write) at boot.
+
+Modules imported lazily, after install time, are still found through the
+rest of the `sys.path` the service was installed with, which is appended
+as a fallback unless the bundle is isolated. Only an isolated bundle is
+run with -S (no site module) as well, the fallback may need the .pth files
+of site-packages to be processed. Modules imported by those are left out
+of the bundle, they are set up by the site module.
+"""
+import os
+import re
+import sys
+import shutil
+import compileall
+import subprocess
+import sysconfig
+import py_compile
+import site
+import time
+
+# The name the service script is bundled under
+MAIN_MODULE = "_pyservice_main"
+
+# Modules the site module imports itself
+SITE_HOOKS = ("sitecustomize", "usercustomize", "_distutils_hack")
+
+# Imports on the executable lines of .pth files
+PTH_IMPORT = re.compile(r"""\bimport\s+([\w.]+)|__import__\(\s*['"]([\w.]+)""")
+
+BOOTSTRAP = '''\
+import sys
+sys.path[:0] = [{site!r}]
+sys.path.extend({fallback!r})
+import runpy
+runpy.run_module({main!r}, run_name="__main__", alter_sys=True)
+'''
+
+
+def _is_under(path, directories):
+    """Determines whether a path is inside any of the directories.
+
+    :param path: The path to check
+    :param directories: The directories to check against
+    :type path: str
+    :type directories: list
+    :rtype: Boolean
+    """
+    path = os.path.realpath(path)
+    for directory in directories:
+        directory = os.path.realpath(directory)
+        if path == directory or path.startswith(directory + os.sep):
+            return True
+    return False
+
+
+def _site_directories():
+    """Lists the directories third party modules are installed in.
+
+    :rtype: list
+    """
+    paths = sysconfig.get_paths()
+    directories = [paths["purelib"], paths["platlib"]]
+    if hasattr(site, "getsitepackages"):
+        directories.extend(site.getsitepackages())
+    if getattr(site, "ENABLE_USER_SITE", False):
+        directories.append(site.getusersitepackages())
+    return directories
+
+
+def _stdlib_directories():
+    """Lists the directories of the standard library.
+
+    :rtype: list
+    """
+    paths = sysconfig.get_paths()
+    return [paths["stdlib"], paths["platstdlib"]]
+
+
+def _is_stdlib(path):
+    """Determines whether a path is part of the standard library.
+
+    :param path: The path to check
+    :type path: str
+    :rtype: Boolean
+    """
+    return (_is_under(path, _stdlib_directories()) and
+            not _is_under(path, _site_directories()))
+
+
+def _site_hooks():
+    """Lists the top level modules which are imported by the site module,
+    as hooks of its own or by the .pth files in site-packages.
+
+    :rtype: set
+    """
+    hooks = set(SITE_HOOKS)
+    for directory in _site_directories():
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            continue
+        for name in names:
+            if not name.endswith(".pth"):
+                continue
+            try:
+                with open(os.path.join(directory, name)) as file:
+                    lines = file.read().splitlines()
+            except (IOError, OSError, UnicodeDecodeError):
+                continue
+            for line in lines:
+                if not line.startswith(("import ", "import\t")):
+                    continue
+                for match in PTH_IMPORT.finditer(line):
+                    hooks.add((match.group(1) or match.group(2)).split(".")[0])
+    return hooks
+
+
+def collect_modules():
+    """Finds the top level modules and packages outside the standard library
+    which are currently imported.
+
+    :returns: Maps top level names to the file or package directory
+    :rtype: dict
+    """
+    found = {}
+    hooks = _site_hooks()
+    for name, module in list(sys.modules.items()):
+        top = name.split(".")[0]
+        # The service script itself is bundled under MAIN_MODULE, also
+        # when multiprocessing has aliased it as __mp_main__
+        if top.startswith("__") or top == MAIN_MODULE or top in found or top in hooks:
+            continue
+
+        top_module = sys.modules.get(top)
+        if top_module is None:
+            continue
+
+        package_path = list(getattr(top_module, "__path__", None) or [])
+        location = package_path[0] if package_path else getattr(top_module, "__file__", None)
+        if not location or not os.path.exists(location):
+            continue
+
+        if _is_stdlib(location):
+            continue
+        found[top] = location
+    return found
+
+
+def build(script, destination, isolated=False):
+    """Builds a bundle for a service script.
+
+    :param script: The path of the service script
+    :param destination: The directory to build the bundle in, anything
+        already there is replaced
+    :param isolated: Whether to leave out the fallback to the `sys.path`
+        the service was installed with
+    :type script: str
+    :type destination: str
+    :type isolated: bool
+    :returns: The command which runs the bundled service
+    :rtype: list
+    """
+    site_directory = os.path.join(destination, "site")
+    if os.path.exists(destination):
+        shutil.rmtree(destination)
+    os.makedirs(site_directory, 0o755)
+
+    ignore = shutil.ignore_patterns("__pycache__", "*.pyc")
+    for name, location in sorted(collect_modules().items()):
+        if os.path.isdir(location):
+            shutil.copytree(location, os.path.join(site_directory, name), ignore=ignore)
+        else:
+            shutil.copy2(location, os.path.join(site_directory, os.path.basename(location)))
+    shutil.copy2(script, os.path.join(site_directory, MAIN_MODULE + ".py"))
+
+    # Hash checked bytecode stays valid no matter what happens to the
+    # timestamps of the files, and is verified against the source
+    compileall.compile_dir(site_directory, quiet=1,
+                           invalidation_mode=py_compile.PycInvalidationMode.CHECKED_HASH)
+
+    fallback = []
+    if not isolated:
+        script_directory = os.path.dirname(os.path.abspath(script))
+        fallback = [path for path in sys.path
+                    if path and os.path.isdir(path) and
+                    os.path.realpath(path) != os.path.realpath(script_directory) and
+                    not _is_stdlib(path)]
+
+    bootstrap = os.path.join(destination, "__main__.py")
+    with open(bootstrap, "w") as file:
+        file.write(BOOTSTRAP.format(site=site_directory, fallback=fallback, main=MAIN_MODULE))
+
+    # Without the fallback nothing is needed from site-packages, so the
+    # site module can be skipped too
+    if isolated:
+        return [sys.executable, "-I", "-S", bootstrap]
+    return [sys.executable, "-I", bootstrap]
+
+
+def measure(command, runs=5):
+    """Measures how long a service takes to start, by timing how long its
+    control script takes to print its help.
+
+    :param command: The command which runs the service
+    :param runs: How many times to run it
+    :type command: list
+    :type runs: int
+    :returns: The median number of seconds, or None if it failed
+    :rtype: float
+    """
+    timings = []
+    with open(os.devnull, "w") as devnull:
+        for _ in range(runs):
+            started = time.monotonic()
+            if subprocess.call(command + ["--help"], stdout=devnull, stderr=devnull) != 0:
+                return None
+            timings.append(time.monotonic() - started)
+    timings.sort()
+    return timings[len(timings) // 2]
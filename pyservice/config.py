@@ -0,0 +1,163 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+"""This module implements the configuration of Linux services, enabled with
+`service(config=path)` and available as `self.config`.
+
+The configuration file is parsed once when the service starts, into a
+snapshot which can't be modified: mappings become read-only and lists
+become tuples. When the service receives SIGHUP, or the `reload` command
+on its control socket, the file is parsed again off the thread running
+the service. Only when that succeeds the snapshot is replaced, which is a
+single assignment, so a service always sees either the old or the new
+configuration as a whole. A configuration which fails to parse or
+validate is rejected and the old one stays in place.
+"""
+import os
+import json
+import time
+import threading
+import collections
+import configparser
+from types import MappingProxyType
+
+
+def freeze(value):
+    """Turns parsed configuration into a snapshot which can't be modified.
+
+    :param value: The parsed configuration
+    :returns: The same configuration, with read-only mappings and tuples
+        instead of lists
+    """
+    if isinstance(value, dict):
+        return MappingProxyType(collections.OrderedDict(
+            (key, freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def load_file(path):
+    """Parses a configuration file, the default loader. Files ending in
+    .json are parsed as JSON, anything else as an INI file which results in
+    a mapping of sections to mappings of options.
+
+    :param path: The file to parse
+    :type path: str
+    :returns: The parsed configuration
+    :rtype: dict
+    """
+    if path.endswith(".json"):
+        with open(path) as file:
+            return json.load(file, object_pairs_hook=collections.OrderedDict)
+
+    parser = configparser.ConfigParser(interpolation=None)
+    with open(path) as file:
+        parser.read_file(file)
+    return collections.OrderedDict(
+        (section, collections.OrderedDict(parser.items(section)))
+        for section in parser.sections())
+
+
+class ServiceConfig(object):
+    """Holds the current snapshot of the configuration of a service.
+    """
+    def __init__(self, path, loader=None):
+        """Initializes a new instance of pyservice.config.ServiceConfig.
+
+        :param path: The configuration file, relative paths are resolved
+            against the current working directory
+        :param loader: Parses and validates the file, given its path, and
+            raises an exception when it is invalid. Defaults to `load_file`.
+        :type path: str
+        :type loader: callable
+        """
+        self.path = os.path.abspath(path)
+        self.loader = loader or load_file
+        self.snapshot = None
+        self.loaded_at = None
+        self.reloads = 0
+        self.rejected = 0
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def _parse(self):
+        """Parses the configuration file into a snapshot.
+
+        :returns: The snapshot
+        :raises RuntimeError: When the file can't be parsed or is invalid
+        """
+        try:
+            return freeze(self.loader(self.path))
+        except Exception as error:
+            raise RuntimeError("Invalid configuration in `%s`: %s" % (self.path, error))
+
+    def load(self):
+        """Parses the configuration for the first time.
+
+        :returns: The snapshot
+        :raises RuntimeError: When the file can't be parsed or is invalid
+        """
+        with self._lock:
+            self.snapshot = self._parse()
+            self.loaded_at = time.time()
+            return self.snapshot
+
+    def reload(self):
+        """Parses the configuration again and replaces the snapshot if it
+        is valid.
+
+        :returns: The previous and the new snapshot
+        :rtype: tuple
+        :raises RuntimeError: When the configuration is rejected, the
+            snapshot is left as it was
+        """
+        with self._lock:
+            old = self.snapshot
+            try:
+                new = self._parse()
+            except RuntimeError as error:
+                self.rejected += 1
+                self.last_error = str(error)
+                raise
+
+            self.snapshot = new
+            self.loaded_at = time.time()
+            self.reloads += 1
+            self.last_error = None
+            return old, new
+
+    def stats(self):
+        """Describes the configuration, this is reported under `config` by
+        `status`.
+
+        :returns: The path, when it was loaded, the number of reloads and
+            rejected reloads, and why the last reload was rejected
+        :rtype: dict
+        """
+        info = collections.OrderedDict()
+        info["path"] = self.path
+        if self.loaded_at is not None:
+            info["age"] = round(time.time() - self.loaded_at, 3)
+        info["reloads"] = self.reloads
+        info["rejected"] = self.rejected
+        if self.last_error is not None:
+            info["last_error"] = self.last_error
+        return info
@@ -0,0 +1,194 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+"""This module implements the control socket of a running Linux service.
+
+Every daemon listens on a Unix socket next to its PID file. A request is a
+single line of JSON naming a command and its arguments, the reply is a
+single line of JSON holding either the result of the command or an error.
+
+This is what the `status` subcommand of the control script talks to, so
+that it can report on what is going on inside the daemon.
+"""
+import os
+import json
+import socket
+import threading
+
+from .utils import bind_unix_socket
+
+# Requests and replies are small, anything larger than this is garbage
+MAX_MESSAGE_SIZE = 1024 * 1024
+
+
+def send_message(sock, message):
+    """Writes a message to a socket as a single line of JSON.
+
+    :param sock: The socket to write to
+    :param message: The message to write, must be serializable to JSON
+    :type sock: socket.socket
+    :type message: dict
+    :returns: None
+    :rtype: None
+    """
+    sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+
+
+def read_message(sock):
+    """Reads a single line of JSON from a socket.
+
+    :param sock: The socket to read from
+    :type sock: socket.socket
+    :returns: The decoded message or None if the peer closed the connection
+    :rtype: dict
+    """
+    data = b""
+    while b"\n" not in data:
+        chunk = sock.recv(4096)
+        if not chunk:
+            return None
+        data += chunk
+        if len(data) > MAX_MESSAGE_SIZE:
+            raise RuntimeError("Message exceeds %d bytes" % MAX_MESSAGE_SIZE)
+
+    return json.loads(data.split(b"\n", 1)[0].decode("utf-8"))
+
+
+def request(path, command, timeout=5, **args):
+    """Sends a command to the control socket of a running service.
+
+    :param path: Path of the control socket
+    :param command: Name of the command to run
+    :param timeout: Seconds to wait for a reply
+    :param args: Arguments for the command
+    :type path: str
+    :type command: str
+    :type timeout: float
+    :returns: The result of the command
+    :raises RuntimeError: When the service reports an error
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+        send_message(sock, {"command": command, "args": args})
+        reply = read_message(sock)
+    finally:
+        sock.close()
+
+    if reply is None:
+        raise RuntimeError("Connection closed without a reply")
+    if not reply.get("ok"):
+        raise RuntimeError(reply.get("error", "Unknown error"))
+    return reply.get("result")
+
+
+class ControlServer(object):
+    """Serves the commands of a service on a Unix socket.
+
+    Each connection is handled on its own thread so a slow command (like
+    stopping something) does not hold up a `status` request.
+    """
+    def __init__(self, path, commands):
+        """Initializes a new instance of pyservice.control.ControlServer.
+
+        :param path: Path of the socket to listen on
+        :param commands: Maps command names to callables, the arguments of
+            a request are passed as keyword arguments and the return value
+            is sent back as the result
+        :type path: str
+        :type commands: dict
+        """
+        self.path = path
+        self.commands = commands
+        self._socket = None
+
+    def start(self):
+        """Binds the socket and starts serving requests in the background.
+
+        :returns: None
+        :rtype: None
+        """
+        self._socket = bind_unix_socket(self.path)
+        os.chmod(self.path, 0o600)
+        self._socket.listen(16)
+
+        thread = threading.Thread(target=self._serve, name="pyservice-control")
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        """Stops serving requests and removes the socket.
+
+        :returns: None
+        :rtype: None
+        """
+        if self._socket is None:
+            return
+
+        self._socket.close()
+        self._socket = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            # After dropping privileges we may no longer be allowed to, the
+            # next instance will remove it
+            pass
+
+    def _serve(self):
+        """Accepts connections until the server is closed.
+        """
+        while self._socket is not None:
+            try:
+                connection, _ = self._socket.accept()
+            except (OSError, AttributeError):
+                return
+
+            thread = threading.Thread(target=self._handle, args=(connection, ))
+            thread.daemon = True
+            thread.start()
+
+    def _handle(self, connection):
+        """Runs the command requested on a connection and sends back the reply.
+
+        :param connection: The accepted connection
+        :type connection: socket.socket
+        """
+        try:
+            message = read_message(connection)
+            if message is None:
+                return
+
+            command = self.commands.get(message.get("command"))
+            if command is None:
+                reply = {"ok": False,
+                         "error": "Unknown command: %s" % message.get("command")}
+            else:
+                try:
+                    reply = {"ok": True, "result": command(**message.get("args", {}))}
+                except Exception as error:
+                    reply = {"ok": False, "error": str(error)}
+
+            send_message(connection, reply)
+        except Exception:
+            # The client went away or sent garbage, nothing to reply to
+            pass
+        finally:
+            connection.close()
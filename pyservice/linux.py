@@ -36,18 +36,37 @@ import os
 import stat
 import sys
 import pwd
+import errno
 import atexit
 import signal
 import argparse
 import time
+import queue
+import select
+import shutil
 import textwrap
-from functools import wraps
+import threading
+import traceback
+import collections
+from functools import wraps, partial
+
+from . import control
+from .trace import Trace, summarize
+from .supervisor import SupervisedThread
+
+# The modules of the optional features are imported once they are used, so
+# a service doesn't pay for importing what it doesn't use every time it
+# starts
 
 def handle_cli(_service, argv=None):
     """This will parse the options specified on the command line
     and call the associated function:
 
-    Valid subcommands: install, remove, start, stop, run
+    Valid subcommands: install, remove, start, stop, status, history, reload,
+    run, foreground
+
+    Services created with `host` additionally get the `member` subcommand
+    to start, stop or restart one of the services they host.
 
     If none of the command line parameters above is specified, it
     will default to `run` which will run the program in the foreground
@@ -70,6 +89,10 @@ def handle_cli(_service, argv=None):
     install = subparsers.add_parser("install",
                                     help="Install the {} service".format(_service.name))
     install.add_argument("--user", help="the user to run as", required=True)
+    install.add_argument("--bundle", action="store_true",
+                         help="run from a precompiled bundle, which starts faster")
+    install.add_argument("--isolated", action="store_true",
+                         help="only let the bundle import the modules it holds")
     install.set_defaults(func=_service.install)
     
     remove = subparsers.add_parser("remove",
@@ -84,11 +107,38 @@ def handle_cli(_service, argv=None):
     stop = subparsers.add_parser("stop",
                                     help="Stop the {} service".format(_service.name))
     stop.set_defaults(func=_service.stop)
+
+    status = subparsers.add_parser("status",
+                                   help="Show the status of the {} service".format(_service.name))
+    status.set_defaults(func=_service.status)
+
+    history = subparsers.add_parser("history",
+                                    help="Summarize how long starting and stopping "
+                                         "{} took".format(_service.name))
+    history.set_defaults(func=_service.history)
+
+    reload = subparsers.add_parser("reload",
+                                   help="Reload the configuration of the {} service".format(_service.name))
+    reload.set_defaults(func=_service.reload)
+
+    if _service.members:
+        member = subparsers.add_parser("member",
+                                       help="Control a service hosted by {}".format(_service.name))
+        member.add_argument("action", choices=["start", "stop", "restart"])
+        member.add_argument("member", choices=list(_service.members))
+        member.set_defaults(func=_service.member)
     
     run = subparsers.add_parser("run",
                                 help="Run {} in the foreground without installing as a service".format(_service.name))
+    run.add_argument("--user", help="the user to run as")
     run.set_defaults(func=_service.started)
 
+    foreground = subparsers.add_parser("foreground",
+                                       help="Run {} in the foreground as the main process "
+                                            "of a container".format(_service.name))
+    foreground.add_argument("--user", help="the user to run as")
+    foreground.set_defaults(func=_service.foreground)
+
     args = parser.parse_args(argv)
     kwargs = vars(args)
 
@@ -100,15 +150,147 @@ def handle_cli(_service, argv=None):
         sys.exit(1)
 
 
+def _print_status(info, indent=2):
+    """Prints the status reported by a service, one key per line.
+
+    :param info: The status to print
+    :param indent: The number of spaces to indent with
+    :type info: dict
+    :type indent: int
+    :returns: None
+    :rtype: None
+    """
+    for key, value in info.items():
+        if isinstance(value, dict):
+            print('%s%s:' % (' ' * indent, key))
+            _print_status(value, indent + 2)
+        else:
+            print('%s%s: %s' % (' ' * indent, key, value))
+
+
+def _is_alive(pid):
+    """Determines whether a process exists and has not yet exited.
+
+    :param pid: The process to check
+    :type pid: int
+    :returns: True when the process is alive and False otherwise.
+    :rtype: Boolean
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError as error:
+        return error.errno != errno.ESRCH
+
+    # A process which exited but was not yet reaped is a zombie, it still
+    # exists but for our purposes it has stopped
+    try:
+        with open('/proc/%d/stat' % pid) as file:
+            return file.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except (IOError, OSError, IndexError):
+        return True
+
+
+def _exit_code(code):
+    """Translates the argument of SystemExit into a process exit code.
+
+    :param code: The code SystemExit was raised with
+    :returns: The exit code the interpreter will use
+    :rtype: int
+    """
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    return 1
+
+
 # , service, name, description, auto_start
-def service(func):
+def service(func=None, wait_ready=False, start_timeout=30, stop_timeout=10,
+            pool_workers=None, pool_timeout=None, listen=None, idle_timeout=300,
+            state_version=0, monitor=False, monitor_threshold=0.1, config=None,
+            config_loader=None, threads=None, handler=None, watch=None,
+            watch_window=0.05, memory_pressure=False, graceful_stop=False):
     """Decorator to turn a function into a Linux service.
     
     Handles runas, daemonization and installation as a service
+
+    Can be used either bare (`@service`) or with options
+    (`@service(wait_ready=True)`).
     
     :param func: The function to turn into a service
+    :param wait_ready: When True, `start` waits for the service to call
+        `self.ready()` instead of considering it ready as soon as `func`
+        is entered
+    :param start_timeout: Seconds `start` waits for the service to become
+        ready before reporting a failure
+    :param stop_timeout: Seconds `stop` gives the service to exit, with
+        `graceful_stop` to return from `func` after setting
+        `stop_requested`, before forcing it to exit
+    :param pool_workers: Number of worker processes of `self.pool`,
+        defaults to the number of CPUs the daemon may run on
+    :param pool_timeout: Seconds `self.pool.run` waits for a task before
+        killing it, defaults to waiting forever
+    :param listen: Enables on-demand activation: the daemon only holds a
+        socket listening on this address (a path or a (host, port) tuple)
+        and runs `func` in a child process, with the socket as
+        `self.socket`, once a connection arrives. A socket passed by
+        systemd (LISTEN_FDS) to `start`, `run` or `foreground` is used
+        instead when there is one.
+    :param idle_timeout: Seconds without calls to `self.mark_active()`
+        after which an activated service is asked to stop
+    :param state_version: Version of the snapshots written by `self.state`,
+        bump it when the format changes to discard old snapshots
+    :param monitor: Whether to measure scheduling delay, event loop lag and
+        GC pauses while the service runs, see `pyservice.monitor`
+    :param monitor_threshold: Seconds of delay after which the monitor
+        writes the stacks of the offending threads to the run directory
+    :param config: Path of the configuration file of the service, which is
+        parsed when it starts and again on SIGHUP or the `reload`
+        subcommand, see `pyservice.config`
+    :param config_loader: Parses and validates the configuration file,
+        given its path, raising an exception when it is invalid. Defaults
+        to JSON for .json files and INI for anything else.
+    :param threads: Runs the service on this many supervised threads: each
+        runs a copy of `func`, or with `handler` each runs the handler for
+        the items `func` passes to `self.dispatch`. A thread which raises an
+        exception is restarted after a growing delay.
+    :param handler: Called as `handler(self, item)` for every dispatched
+        item, on one of the `threads` threads
+    :param watch: Paths or glob patterns (wildcards in the file name only)
+        to watch with inotify, changes are consumed with `self.changes()`
+    :param watch_window: Seconds during which changes are coalesced into
+        one batch
+    :param memory_pressure: Whether to watch memory pressure and call
+        `under_pressure(level)` when there is any, see `pyservice.pressure`
+    :param graceful_stop: Whether SIGTERM only sets `stop_requested`, for
+        services which check it and return from `func`, instead of making
+        the service exit right away. Implied by `threads` and `listen`, and
+        the default for `host`.
     :type func: callable 
+    :type wait_ready: bool
+    :type start_timeout: float
+    :type stop_timeout: float
+    :type pool_workers: int
+    :type pool_timeout: float
+    :type listen: str or tuple
+    :type idle_timeout: float
+    :type state_version: int
+    :type monitor: bool
+    :type monitor_threshold: float
+    :type config: str
+    :type config_loader: callable
+    :type threads: int
+    :type handler: callable
+    :type watch: list
+    :type watch_window: float
+    :type memory_pressure: bool
+    :type graceful_stop: bool
     """
+    if func is None:
+        # Used with options, return a decorator which applies them
+        options = dict(locals())
+        del options["func"]
+        return partial(service, **options)
     
     class LinuxService(object):
         """Implements service functionality (using daemons) on Linux.
@@ -118,38 +300,745 @@ def service(func):
             """
 
             self.name = func.__name__
+            self.main = func
             self.description = getattr(
                     func,
                     "__doc__", 
                     "A cross-platform service powered by PyService")
             self.stop_requested = False
-
-            # We store a start script in /etc/init.d, for now we don't support
-            # system who don't have it
-            if not os.path.exists('/etc/init.d'):
-                raise RuntimeError('`/etc/init.d` does not exists, this '
-                                   'platform is unsupported.')
+            self.wait_ready = wait_ready
+            self.start_timeout = start_timeout
+            self.stop_timeout = stop_timeout
+            self.graceful_stop = graceful_stop or bool(threads) or listen is not None
+            self.started_at = None
+            self._pool = None
+            self._state = None
+            self.monitor = None
+            self.pressure = None
+            self._config = None
+            if config is not None:
+                from .config import ServiceConfig
+                self._config = ServiceConfig(config, config_loader)
+            self._watcher = None
+
+            # Monotonic timestamps at which starting and stopping began, the
+            # duration of lifecycle events is measured from these
+            self._start_origin = None
+            self._stop_origin = None
+            self.ready_at = None
+
+            # On-demand activation, see `_activate`
+            self.socket = None
+            self.last_active = None
+            self.activations = 0
+            self._child = None
+
+            # Services hosted by this one, see `host`
+            self.members = collections.OrderedDict()
+
+            # Threads running the body when `threads` is set, see `_run_body`
+            self.workers = collections.OrderedDict()
+            self._queue = None
+            self._producing = False
+            self._handled = {}
+
+            # Commands served on the control socket of the daemon
+            self.commands = {
+                "status": self.status_info,
+                "member": self._member_command,
+                "reload": self._reload_command,
+            }
+            self._control = None
+
+            # Write end of the readiness pipe, only set in the daemon
+            # until it has reported that it is ready
+            self._ready_fd = None
 
             pid_files_directory = os.path.join("/var", "run")
 
             # Build up some paths
             self.pid_file = os.path.join(pid_files_directory, self.name + '.pid')
+            self.control_socket = os.path.join(pid_files_directory, self.name + '.sock')
+            self.run_directory = os.path.join(pid_files_directory, self.name)
             self.control_script = '/etc/init.d/%s' % self.name
+            self.bundle_directory = os.path.join('/var/lib/pyservice', self.name)
+            self.trace = Trace(os.path.join('/var/log/pyservice', self.name, 'trace.jsonl'))
 
-        def started(self, user):
+        def started(self, user=None):
             """Runs the actual business logic of the service
             
-            :param user: The user to run as
+            :param user: The user to run as, defaults to the current user
             :type user: str
+            :returns: True once the business logic has returned
+            :rtype: Boolean
+            """
+            # When run in the foreground, starting begins here
+            if self._start_origin is None:
+                self._start_origin = time.monotonic()
+
+            code = 0
+            try:
+                # Privileged ports can only be bound before dropping privileges
+                if listen is not None and self.socket is None:
+                    from . import activation
+                    self.socket = (activation.systemd_socket() or
+                                   activation.listening_socket(listen))
+
+                # So are the triggers on memory pressure
+                if memory_pressure:
+                    from .pressure import PressureWatch
+                    self.pressure = PressureWatch(self._under_pressure)
+
+                if user is not None:
+                    try:
+                        uid = pwd.getpwnam(user)
+                    except KeyError:
+                        raise RuntimeError("* user {} does not seem to exist.".format(user))
+                    self._prepare_run_directory(uid)
+                    os.setuid(uid.pw_uid)
+                    self._emit("privdrop", self._start_origin, user=user)
+                else:
+                    self._prepare_run_directory(None)
+
+                # An invalid configuration fails the start, later on it is
+                # merely rejected
+                configured = self._configured()
+                for instance in configured:
+                    instance._config.load()
+
+                # With `graceful_stop` the first SIGTERM asks the service to
+                # stop and a second one makes it exit right away
+                signal.signal(signal.SIGTERM, self._handle_signal)
+                if configured:
+                    signal.signal(signal.SIGHUP, self._handle_reload_signal)
+                self.started_at = time.time()
+
+                # Unless the service reports readiness itself, entering
+                # the body is as ready as it gets. When activated on demand
+                # we are ready as soon as the socket is listening.
+                if not self.wait_ready or self.socket is not None:
+                    self.ready()
+                if self.socket is not None:
+                    self._activate()
+                    return True
+
+                self._emit("body_enter", self._start_origin)
+                self._start_monitor()
+                try:
+                    self._run_body()
+                finally:
+                    self._emit("drain", self._stop_origin)
+                    self._shutdown()
+            except SystemExit as error:
+                code = _exit_code(error.code)
+                self._report_exit(code)
+                raise
+            except BaseException:
+                code = 1
+                self._report_exit(code)
+                raise
+            finally:
+                self._emit("exit", self._stop_origin, exit_code=code)
+            return True
+
+        def _emit(self, event, origin=None, **fields):
+            """Records a lifecycle event in the trace of this service.
+
+            :param event: The name of the event
+            :param origin: Monotonic timestamp at which the phase this event
+                is part of began, to compute its duration from
+            :type event: str
+            :type origin: float
+            :returns: None
+            :rtype: None
+            """
+            if origin is not None:
+                fields["duration"] = time.monotonic() - origin
+            self.trace.emit(event, **fields)
+
+        def history(self):
+            """Prints how long the phases of starting and stopping this
+            service took, according to its trace.
+
+            :returns: True when there is any history and False otherwise.
+            :rtype: Boolean
+            """
+            events = self.trace.read()
+            if not events:
+                print('* No history')
+                return False
+
+            print('* %d events since %s' % (len(events), time.ctime(events[0]["time"])))
+            print('  %-12s %6s %10s %10s %10s %10s' % ('event', 'count', 'p50', 'p90', 'p99', 'max'))
+            for event, summary in summarize(events).items():
+                print('  %-12s %6d %9.3fs %9.3fs %9.3fs %9.3fs' % (
+                    event, summary["count"], summary["p50"], summary["p90"],
+                    summary["p99"], summary["max"]))
+
+            # Why the service had to be restarted and how it exited
+            for event, field in (("restart", "reason"), ("exit", "exit_code")):
+                counts = collections.Counter(
+                    str(item.get(field)) for item in events if item["event"] == event)
+                if counts:
+                    print('* %s: %s' % (event, ', '.join(
+                        '%s x%d' % (key, count) for key, count in counts.most_common())))
+            return True
+
+        def mark_active(self):
+            """Tells an activated service that it is not idle, the service is
+            asked to stop after `idle_timeout` seconds without calls to this.
+
+            :returns: None
+            :rtype: None
+            """
+            self.last_active = time.time()
+
+        def accept(self):
+            """Accepts a connection on the socket of an activated service,
+            marking the service as active.
+
+            :returns: The connection and the address of the peer, or None
+                once the service has been asked to stop
+            :rtype: tuple
+            """
+            while not self.stop_requested:
+                readable, _, _ = select.select([self.socket], [], [], 0.5)
+                if readable:
+                    self.mark_active()
+                    return self.socket.accept()
+            return None
+
+        def _activate(self):
+            """Waits for connections on the socket and runs `func` in a child
+            process when one arrives, until the service is stopped.
+
+            :returns: None
+            :rtype: None
+            """
+            while not self.stop_requested:
+                readable, _, _ = select.select([self.socket], [], [], 1)
+                if not readable or self.stop_requested:
+                    continue
+
+                self.activations += 1
+                activated_at = time.time()
+                origin = time.monotonic()
+                child = os.fork()
+                if child == 0:
+                    os._exit(self._run_activated())
+
+                self._child = child
+                self._emit("activate", child_pid=child)
+                status = 0
+                try:
+                    _, status = os.waitpid(child, 0)
+                except ChildProcessError:
+                    pass
+                self._child = None
+                self._emit("deactivate", origin, exit_code=(
+                    128 + os.WTERMSIG(status) if os.WIFSIGNALED(status)
+                    else os.WEXITSTATUS(status)))
+
+                # Don't spin if the service exits without taking the
+                # connection which activated it
+                if time.time() - activated_at < 1:
+                    time.sleep(1)
+
+        def _run_activated(self):
+            """Runs `func` in the child process of an activated service.
+
+            :returns: The exit code of the child process
+            :rtype: int
+            """
+            self.stop_requested = False
+            self.started_at = time.time()
+            self.mark_active()
+
+            def watch_idle():
+                while not self.stop_requested:
+                    if time.time() - self.last_active > idle_timeout:
+                        self.request_stop()
+                        break
+                    time.sleep(min(idle_timeout / 4.0, 1))
+
+            watchdog = threading.Thread(target=watch_idle, name="pyservice-idle")
+            watchdog.daemon = True
+            watchdog.start()
+
+            self._start_monitor()
+            try:
+                self._run_body()
+                return 0
+            except SystemExit as error:
+                return _exit_code(error.code)
+            except BaseException:
+                traceback.print_exc()
+                return 1
+            finally:
+                self._shutdown()
+                sys.stdout.flush()
+                sys.stderr.flush()
+
+        def foreground(self, user=None):
+            """Runs the service in the foreground as the main process of a
+            container, without daemonizing and without it being installed.
+
+            Output is written to stdout and stderr unbuffered and SIGINT stops
+            the service like SIGTERM does. When running as PID 1 the service
+            runs in a child process, while this process forwards signals to it,
+            reaps orphaned processes and exits with the status of the child.
+
+            :param user: The user to run as, defaults to the current user
+            :type user: str
+            :returns: True once the service has stopped
+            :rtype: Boolean
+            """
+            for stream in (sys.stdout, sys.stderr):
+                if hasattr(stream, "reconfigure"):
+                    stream.reconfigure(line_buffering=True, write_through=True)
+            os.environ["PYTHONUNBUFFERED"] = "1"
+
+            if os.getpid() == 1:
+                child = os.fork()
+                if child > 0:
+                    sys.exit(self._init(child))
+
+            signal.signal(signal.SIGINT, self._handle_signal)
+            return self.started(user)
+
+        def _init(self, child):
+            """Does what PID 1 is expected to do while the service runs in a
+            child process.
+
+            :param child: The PID of the process running the service
+            :type child: int
+            :returns: The exit code of the child, 128 + the signal number if
+                it was killed by a signal
+            :rtype: int
+            """
+            # PID 1 does not get the default action for signals it has no
+            # handler for, so pass the ones that matter on to the service
+            def forward(signum, frame):
+                try:
+                    os.kill(child, signum)
+                except OSError:
+                    pass
+
+            for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP,
+                           signal.SIGQUIT, signal.SIGUSR1, signal.SIGUSR2):
+                signal.signal(signum, forward)
+
+            # Reap whatever exits, orphans get reparented to us, until the
+            # service itself is gone
+            while True:
+                try:
+                    pid, status = os.waitpid(-1, 0)
+                except ChildProcessError:
+                    return 1
+                if pid != child:
+                    continue
+                if os.WIFSIGNALED(status):
+                    return 128 + os.WTERMSIG(status)
+                return os.WEXITSTATUS(status)
+
+        def _prepare_run_directory(self, uid):
+            """Creates the run directory of this service (and the services it
+            hosts) and hands it to the user the service will run as. Failing
+            to do so is not fatal, only the features using it won't work.
+
+            :param uid: The user the service will run as, None for the
+                current user
+            :type uid: pwd.struct_passwd
+            :returns: None
+            :rtype: None
+            """
+            for instance in [self] + [member.service for member in self.members.values()]:
+                try:
+                    if not os.path.isdir(instance.run_directory):
+                        os.makedirs(instance.run_directory, 0o750)
+                    if uid is not None:
+                        os.chown(instance.run_directory, uid.pw_uid, uid.pw_gid)
+                except OSError:
+                    pass
+
+                # The daemon keeps adding to the trace after dropping
+                # privileges, and has to be able to rotate it
+                if uid is not None:
+                    try:
+                        os.close(instance.trace.open())
+                        for path in (os.path.dirname(instance.trace.path),
+                                     instance.trace.path, instance.trace.path + ".1"):
+                            if os.path.exists(path):
+                                os.chown(path, uid.pw_uid, uid.pw_gid)
+                    except OSError:
+                        pass
+
+        @property
+        def state(self):
+            """Snapshots of the warm state of this service, kept in its run
+            directory across restarts.
+
+            :rtype: pyservice.state.ServiceState
+            """
+            if self._state is None:
+                from .state import ServiceState
+                self._state = ServiceState(
+                    os.path.join(self.run_directory, "state"), state_version)
+            return self._state
+
+        @property
+        def config(self):
+            """The current snapshot of the configuration of this service,
+            read-only mappings and tuples as parsed from the `config` file.
+            Take it once per unit of work to see a consistent configuration.
+
+            :rtype: types.MappingProxyType
+            """
+            if self._config is None:
+                return None
+            if self._config.snapshot is None:
+                self._config.load()
+            return self._config.snapshot
+
+        def _configured(self):
+            """Lists this service and the services it hosts which have a
+            configuration file.
+
+            :rtype: list
+            """
+            return [instance for instance in
+                    [self] + [member.service for member in self.members.values()]
+                    if instance._config is not None]
+
+        @property
+        def pool(self):
+            """A process pool for CPU bound work, created on first use and
+            shut down when the service stops.
+
+            :rtype: pyservice.pool.ServicePool
+            """
+            if self._pool is None:
+                from .pool import ServicePool
+                self._pool = ServicePool(pool_workers, pool_timeout)
+            return self._pool
+
+        @property
+        def watcher(self):
+            """Watches the `watch` patterns with inotify, created on first use
+            and closed when the service stops. Use `watcher.add` to watch more.
+
+            :rtype: pyservice.watch.Watcher
+            """
+            if self._watcher is None:
+                from .watch import Watcher
+                self._watcher = Watcher(watch or (), watch_window)
+            return self._watcher
+
+        def changes(self, existing=False):
+            """Waits for watched files to change, until the service is asked
+            to stop. Changes arriving in quick succession are coalesced.
+
+            :param existing: Whether to start with a batch of the files
+                which already exist
+            :type existing: bool
+            :returns: Batches of the paths which were created, modified,
+                moved or deleted, sorted
+            :rtype: generator
+            """
+            watcher = self.watcher
+            if existing:
+                batch = watcher.matching()
+                if batch:
+                    yield batch
+
+            while not self.stop_requested:
+                batch = watcher.wait(0.5)
+                if batch:
+                    yield batch
+
+        def _start_monitor(self):
+            """Starts the latency monitor and the memory pressure watch, if
+            they are enabled.
+
+            :returns: None
+            :rtype: None
+            """
+            if monitor and self.monitor is None:
+                from .monitor import Monitor
+                self.monitor = Monitor(os.path.join(self.run_directory, "stacks.txt"),
+                                       monitor_threshold)
+                self.monitor.start()
+
+            if self.pressure is not None:
+                self.pressure.start()
+
+        def _under_pressure(self, level):
+            """Passes a memory pressure event on to this service and the
+            services it hosts.
+
+            :param level: "moderate" or "critical"
+            :type level: str
+            :returns: None
+            :rtype: None
+            """
+            self._emit("pressure", level=level)
+            for instance in [self] + [member.service for member in self.members.values()]:
+                try:
+                    instance.under_pressure(level)
+                except Exception:
+                    traceback.print_exc()
+
+        def trim_memory(self):
+            """Runs a full garbage collection and returns memory the allocator
+            holds on to to the system, a first thing to do when under pressure.
+
+            :returns: The number of resident bytes reclaimed
+            :rtype: int
+            """
+            from .pressure import trim
+            return trim()
+
+        def _run_body(self):
+            """Runs `func`, on supervised threads when `threads` is set, and
+            returns once it is done.
+
             :returns: None
             :rtype: None
             """
-            uid = pwd.getpwnam(user)
+            if not threads:
+                func(self)
+                return
+
+            self.workers.clear()
+            self._handled.clear()
+            if handler is not None:
+                # A bounded queue makes `dispatch` wait for the threads
+                # instead of piling up work
+                self._queue = queue.Queue(threads * 2)
+                self._producing = True
+
+            for index in range(threads):
+                name = "%s-%d" % (self.name, index)
+                if handler is not None:
+                    self._handled[name] = [0, 0.0, None, 0, None]
+                    run = self._handle_items(name)
+                else:
+                    run = lambda: func(self)
+                self.workers[name] = SupervisedThread(name, run, self.request_stop, backoff=1)
+
+            for worker in self.workers.values():
+                worker.start()
+
             try:
-                os.setuid(uid.pw_uid)
-            except KeyError:
-                raise RuntimeError("* user {} does not seem to exist.".format(user))
-            func(self)
+                if handler is not None:
+                    func(self)
+                else:
+                    while not self.stop_requested and any(
+                            worker.is_alive() for worker in self.workers.values()):
+                        time.sleep(0.2)
+            finally:
+                self._producing = False
+                self._join_workers()
+                self._queue = None
+
+        def _handle_items(self, name):
+            """Creates the body of a thread which runs `handler` for the
+            dispatched items, until `func` has returned and they are all
+            handled. An exception raised by `handler` fails only that item,
+            it is logged and counted and the thread carries on.
+
+            :param name: The name of the thread
+            :type name: str
+            :rtype: callable
+            """
+            def run():
+                counters = self._handled[name]
+                while True:
+                    try:
+                        item = self._queue.get(timeout=0.2)
+                    except queue.Empty:
+                        if not self._producing:
+                            return
+                        continue
+
+                    began = time.monotonic()
+                    try:
+                        handler(self, item)
+                    except Exception as error:
+                        counters[3] += 1
+                        counters[4] = "%s: %s" % (type(error).__name__, error)
+                        sys.stderr.write("* %s failed to handle an item:\n" % name)
+                        traceback.print_exc()
+                    finally:
+                        counters[0] += 1
+                        counters[1] += time.monotonic() - began
+                        counters[2] = time.time()
+            return run
+
+        def _join_workers(self):
+            """Stops the threads running the body, all within what is left of
+            `stop_timeout` since the stop signal.
+
+            :returns: None
+            :rtype: None
+            """
+            deadline = time.monotonic() + self._stop_time_left()
+
+            for worker in self.workers.values():
+                worker.stop(max(deadline - time.monotonic(), 0))
+
+            stuck = [name for name, worker in self.workers.items() if worker.is_alive()]
+            if stuck:
+                sys.stderr.write("* Threads still running after the stop deadline: %s\n"
+                                 % ", ".join(stuck))
+
+        def _stop_time_left(self):
+            """Determines how much of `stop_timeout` is left since the stop
+            signal, all of it when the service stopped by itself.
+
+            :returns: The number of seconds
+            :rtype: float
+            """
+            remaining = self.stop_timeout
+            if self._stop_origin is not None:
+                remaining -= time.monotonic() - self._stop_origin
+            return max(remaining, 0)
+
+        def dispatch(self, item, timeout=None):
+            """Passes an item to one of the threads running `handler`, waiting
+            while they are all busy and the queue is full.
+
+            :param item: The item to handle
+            :param timeout: Seconds to wait for room in the queue, defaults
+                to waiting forever
+            :type timeout: float
+            :returns: None
+            :rtype: None
+            :raises queue.Full: When there is still no room after `timeout`
+            """
+            if self._queue is None:
+                raise RuntimeError("%s has no handler to dispatch to" % self.name)
+            self._queue.put(item, timeout=timeout)
+
+        def _shutdown(self):
+            """Releases what the service acquired while running, this is
+            called once `func` has returned.
+
+            :returns: None
+            :rtype: None
+            """
+            if self.monitor is not None:
+                self.monitor.stop()
+                self.monitor = None
+
+            if self.pressure is not None:
+                self.pressure.stop()
+
+            if self._watcher is not None:
+                self._watcher.close()
+                self._watcher = None
+
+            # Tasks still running shortly before the stop deadline are
+            # killed, leaving the daemon a moment to exit before `stop`
+            # escalates
+            if self._pool is not None:
+                self._pool.shutdown(timeout=max(self._stop_time_left() - 0.5, 0))
+                self._pool = None
+
+            # The pool is gone so the state should be settled, take the
+            # final snapshot
+            if self._state is not None:
+                try:
+                    self._state.close()
+                except Exception:
+                    traceback.print_exc()
+                self._state = None
+
+        def request_stop(self):
+            """Asks the service to stop by setting `stop_requested`, `func`
+            is expected to check it regularly and return once it is set.
+
+            :returns: None
+            :rtype: None
+            """
+            self.stop_requested = True
+
+        def _handle_signal(self, signum, frame):
+            """Handles SIGTERM in the daemon.
+
+            :param signum: The signal which was received
+            :param frame: The frame which was interrupted
+            """
+            # An activated service runs in a child process, it gets the same
+            # treatment
+            if self._child is not None:
+                try:
+                    os.kill(self._child, signum)
+                except OSError:
+                    pass
+
+            if self.stop_requested:
+                raise SystemExit(128 + signum)
+            self._stop_origin = time.monotonic()
+            self._emit("stop_signal", signal=signum)
+
+            # A service which doesn't check `stop_requested` exits right away
+            if not self.graceful_stop:
+                raise SystemExit(128 + signum)
+            self.request_stop()
+
+        def _handle_reload_signal(self, signum, frame):
+            """Handles SIGHUP in the daemon by reloading the configuration on
+            another thread, leaving the interrupted one alone.
+
+            :param signum: The signal which was received
+            :param frame: The frame which was interrupted
+            """
+            thread = threading.Thread(target=self._reload_command, name="pyservice-reload")
+            thread.daemon = True
+            thread.start()
+
+        def ready(self):
+            """Signals the process which ran `start` that this service is
+            ready. Only needs to be called by services created with
+            `wait_ready=True`, calling it more than once or when not running
+            as a daemon is harmless.
+
+            :returns: None
+            :rtype: None
+            """
+            if self.ready_at is None:
+                self.ready_at = time.time()
+                self._emit("ready", self._start_origin)
+
+            if self._ready_fd is not None:
+                self._release_launcher(b"READY\n")
+
+                # Startup is over, stop sending stderr to the launching process
+                standard_error = open(os.devnull, 'a+')
+                os.dup2(standard_error.fileno(), sys.stderr.fileno())
+
+        def _release_launcher(self, message):
+            """Sends the final status line to the process which ran `start`.
+            The launcher may already be gone, after timing out, in which case
+            there is no one left to tell.
+
+            :param message: The status line
+            :type message: bytes
+            :returns: None
+            :rtype: None
+            """
+            if self._ready_fd is None:
+                return
+
+            try:
+                os.write(self._ready_fd, message)
+            except OSError as error:
+                if error.errno != errno.EPIPE:
+                    raise
+            finally:
+                os.close(self._ready_fd)
+                self._ready_fd = None
 
         def start(self, user):
             """Starts this service.
@@ -170,6 +1059,14 @@ def service(func):
 
             # Attempt to start the service
             print('* Starting %s' % self.name)
+            self._start_origin = time.monotonic()
+
+            # systemd passes the socket to this process, once we have forked
+            # LISTEN_PID no longer matches
+            if listen is not None:
+                from . import activation
+                self.socket = activation.systemd_socket()
+
             result = self._start()
             if not result:
                 return False
@@ -191,7 +1088,9 @@ def service(func):
 
             # Attempt to stop the service
             print('* Stopping %s' % self.name)
+            origin = time.monotonic()
             result = self._stop()
+            self._emit("stop", origin, ok=result)
             if not result:
                 return False
 
@@ -199,13 +1098,220 @@ def service(func):
             # process, stopped() will be called when the python script exits
             return result
 
-        def install(self, user):
+        def status(self):
+            """Prints the status of this service as reported by the daemon.
+
+            :returns: True when the service is running and False otherwise.
+            :rtype: Boolean
+            """
+            if not self.is_running():
+                print('* Not running')
+                return False
+
+            try:
+                info = control.request(self.control_socket, "status")
+            except Exception as error:
+                print('* Running, unable to query status: %s' % str(error))
+                return True
+
+            print('* %s is running' % self.name)
+            _print_status(info)
+            return True
+
+        def status_info(self):
+            """Describes the running service, this is what the `status`
+            command of the control socket returns.
+
+            :returns: The status of this service
+            :rtype: dict
+            """
+            info = collections.OrderedDict()
+            info["pid"] = os.getpid()
+            if self.started_at is not None:
+                info["uptime"] = round(time.time() - self.started_at, 3)
+            info["stop_requested"] = self.stop_requested
+
+            if self._pool is not None:
+                info["pool"] = self._pool.stats()
+
+            if self._state is not None:
+                info["state"] = self._state.stats()
+
+            if self.monitor is not None:
+                info["monitor"] = self.monitor.stats()
+
+            if self._config is not None:
+                info["config"] = self._config.stats()
+
+            if self._watcher is not None:
+                info["watch"] = self._watcher.stats()
+
+            if self.pressure is not None:
+                info["pressure"] = self.pressure.stats()
+
+            if self.workers:
+                info["threads"] = collections.OrderedDict()
+                for name, worker in self.workers.items():
+                    thread_info = worker.status()
+                    if name in self._handled:
+                        handled, busy, last, failed, error = self._handled[name]
+                        thread_info["handled"] = handled
+                        thread_info["failed_items"] = failed
+                        thread_info["last_item_error"] = error
+                        thread_info["busy"] = round(busy, 3)
+                        thread_info["idle"] = (round(time.time() - last, 3)
+                                               if last is not None else None)
+                    info["threads"][name] = thread_info
+
+            if self.socket is not None:
+                info["activation"] = collections.OrderedDict([
+                    ("address", str(self.socket.getsockname())),
+                    ("activations", self.activations),
+                    ("active_pid", self._child),
+                ])
+
+            if self.members:
+                info["members"] = collections.OrderedDict(
+                    (name, member.status()) for name, member in self.members.items())
+            return info
+
+        def member(self, action, member):
+            """Starts, stops or restarts one of the services hosted by this
+            service (see `host`).
+
+            :param action: One of start, stop or restart
+            :param member: The name of the hosted service
+            :type action: str
+            :type member: str
+            :returns: True when successful and False otherwise.
+            :rtype: Boolean
+            """
+            if not self.is_running():
+                print('* Not running')
+                return False
+
+            verbs = {"start": "Starting", "stop": "Stopping", "restart": "Restarting"}
+            print('* %s %s' % (verbs[action], member))
+            try:
+                result = control.request(self.control_socket, "member",
+                                         timeout=self.stop_timeout + 5,
+                                         action=action, member=member)
+            except Exception as error:
+                print('* Unable to %s %s: %s' % (action, member, str(error)))
+                return False
+
+            _print_status(result)
+            return result["state"] == ("stopped" if action == "stop" else "running")
+
+        def reload(self):
+            """Makes the running service reload its configuration.
+
+            :returns: True when every configuration was reloaded and False otherwise.
+            :rtype: Boolean
+            """
+            if not self.is_running():
+                print('* Not running')
+                return False
+
+            print('* Reloading %s' % self.name)
+            try:
+                result = control.request(self.control_socket, "reload")
+            except Exception as error:
+                print('* Unable to reload: %s' % str(error))
+                return False
+
+            _print_status(result)
+            return all(info["ok"] for info in result.values())
+
+        def _reload_command(self):
+            """Handles the `reload` command of the control socket and SIGHUP:
+            reloads the configuration of this service and the services it
+            hosts, and calls `reconfigured` of those for which it changed.
+
+            :returns: Whether the configuration of each service was reloaded
+                and changed, or why it was rejected, and why `reconfigured`
+                failed if it raised
+            :rtype: dict
+            """
+            configured = self._configured()
+            if not configured:
+                raise RuntimeError("%s has no configuration file" % self.name)
+
+            # An activated service reloads in the child running it as well
+            if self._child is not None:
+                try:
+                    os.kill(self._child, signal.SIGHUP)
+                except OSError:
+                    pass
+
+            results = collections.OrderedDict()
+            for instance in configured:
+                origin = time.monotonic()
+                info = collections.OrderedDict([("ok", True), ("changed", False)])
+                try:
+                    old, new = instance._config.reload()
+                except RuntimeError as error:
+                    info["ok"] = False
+                    info["error"] = str(error)
+                else:
+                    info["changed"] = old != new
+                    if info["changed"]:
+                        # The new configuration is in effect whatever the
+                        # hook makes of it
+                        try:
+                            instance.reconfigured(old, new)
+                        except Exception as error:
+                            traceback.print_exc()
+                            info["hook_error"] = "reconfigured failed: %s" % str(error)
+                results[instance.name] = info
+                self._emit("reload", origin, service=instance.name, **info)
+            return results
+
+        def _member_command(self, action, member):
+            """Handles the `member` command of the control socket.
+
+            :param action: One of start, stop or restart
+            :param member: The name of the hosted service
+            :type action: str
+            :type member: str
+            :returns: The status of the hosted service afterwards
+            :rtype: dict
+            """
+            if member not in self.members:
+                raise KeyError("Unknown member: %s" % member)
+
+            thread = self.members[member]
+            if action == "start":
+                thread.start()
+            elif action == "stop":
+                thread.stop(self.stop_timeout)
+            elif action == "restart":
+                thread.restart(self.stop_timeout)
+            else:
+                raise ValueError("Unknown action: %s" % action)
+            return thread.status()
+
+        def install(self, user, bundle=False, isolated=False):
             """Installs this service.
 
+            :param user: The user the service should run as
+            :param bundle: Whether to run the service from a precompiled bundle
+            :param isolated: Whether the bundle should only hold the modules
+                imported at install time
+            :type user: str
+            :type bundle: bool
+            :type isolated: bool
             :returns: True when successful and False otherwise.
             :rtype: Boolean
             """
 
+            # We store a start script in /etc/init.d, for now we don't support
+            # system who don't have it
+            if not os.path.exists('/etc/init.d'):
+                raise RuntimeError('`/etc/init.d` does not exists, this '
+                                   'platform is unsupported, use the '
+                                   '`foreground` subcommand instead.')
+
             # Make sure the service is not already installed
             if self.is_installed():
                 print('* Already installed')
@@ -213,12 +1319,15 @@ def service(func):
 
             # Attempt to install the service
             print('* Installing %s' % self.name)
-            result = self._install(user)
+            origin = time.monotonic()
+            result = self._install(user, bundle, isolated)
+            self._emit("install", origin, ok=result, user=user, bundle=bundle)
             if not result:
                 return False
 
             # Call event handler
-            return self.installed()
+            self.installed()
+            return result
 
         def uninstall(self):
             """Uninstalls this service.
@@ -239,7 +1348,9 @@ def service(func):
 
             # Attempt to uninstall the service
             print('* Uninstalling %s' % self.name)
+            origin = time.monotonic()
             result = self._uninstall()
+            self._emit("uninstall", origin, ok=result)
             if not result:
                 return False
 
@@ -250,19 +1361,36 @@ def service(func):
         def _start(self):
             """Starts the service (if it's installed and not running).
 
+            The original process does not return from this function, it waits
+            until the daemon reports that it is ready (or dies) and exits
+            with 0 or 1 accordingly.
+
             :returns: True when successful and false otherwise.
             :rtype: Boolean
             """
 
+            # Readiness is reported to the original process over a pipe, the
+            # daemon's stderr goes over a second one until then so startup
+            # errors can be shown to whoever ran `start`
+            sys.stdout.flush()
+            sys.stderr.flush()
+            status_read, status_write = os.pipe()
+            error_read, error_write = os.pipe()
+
             # Attempt to fork parent process (double fork)
             try:
                 pid = os.fork()
                 if pid > 0:
-                        sys.exit(0)
+                    os.close(status_write)
+                    os.close(error_write)
+                    sys.exit(0 if self._await_ready(status_read, error_read) else 1)
             except OSError as error:
                 print('* Unable to fork parent process (1): %s' % format(error))
                 return False
 
+            os.close(status_read)
+            os.close(error_read)
+
             # Decouple from parent environment
             os.setsid()
             os.umask(0)
@@ -276,6 +1404,9 @@ def service(func):
                 print('* Unable to fork parent process (2): %s' % format(error))
                 return False
 
+            self._ready_fd = status_write
+            self._emit("fork", self._start_origin)
+
             # Write the PID file
             pid = str(os.getpid())
             try:
@@ -284,24 +1415,137 @@ def service(func):
                 file.close()
             except Exception as error:
                 print('* Unable to write PID file to `%s`: %s' %(self.pid_file, format(error)))
+                self._report_exit(1)
                 return False
+            self._emit("pidfile", self._start_origin)
+
+            # Listen for control commands, while we still have the
+            # privileges to create the socket
+            self._control = control.ControlServer(self.control_socket, self.commands)
+            try:
+                self._control.start()
+            except Exception as error:
+                print('* Unable to create control socket `%s`: %s'
+                      % (self.control_socket, format(error)))
+                self._control = None
+            else:
+                atexit.register(self._control.close)
 
             # Register cleanup function
             atexit.register(self._clean)
-            atexit.register(self.service.stopped)
+            atexit.register(self.stopped)
 
-            # Redirect standard file descriptors to /dev/null
+            # Redirect standard file descriptors to /dev/null, except for
+            # stderr which goes to the original process until we're ready
             sys.stdout.flush()
-            sys.stdin.flush()
+            sys.stderr.flush()
             standard_in = open(os.devnull, 'r')
             standard_out = open(os.devnull, 'a+')
-            standard_error = open(os.devnull, 'a+')
 
             os.dup2(standard_in.fileno(), sys.stdin.fileno())
             os.dup2(standard_out.fileno(), sys.stdout.fileno())
-            os.dup2(standard_error.fileno(), sys.stderr.fileno())
+            os.dup2(error_write, sys.stderr.fileno())
+            os.close(error_write)
             return True
 
+        def _await_ready(self, status_fd, error_fd):
+            """Waits in the original process for the daemon to report that
+            it is ready, printing its exit code and the last lines it wrote
+            to stderr if it dies before that.
+
+            :param status_fd: Read end of the readiness pipe
+            :param error_fd: Read end of the daemon's stderr pipe
+            :type status_fd: int
+            :type error_fd: int
+            :returns: True when the daemon is ready and False otherwise.
+            :rtype: Boolean
+            """
+            deadline = time.time() + self.start_timeout
+            status = b""
+            errors = b""
+            open_fds = [status_fd, error_fd]
+
+            # Read both pipes until there is a status line, the daemon
+            # closed its end of the readiness pipe or we ran out of time
+            while status_fd in open_fds and b"\n" not in status:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    print('* Timed out after %ss waiting for %s to become ready'
+                          % (self.start_timeout, self.name))
+                    self._emit("start", self._start_origin, ok=False, reason="timeout")
+
+                    # A failed start means nothing is running, and the
+                    # daemon couldn't report to us anymore anyway
+                    self._kill_unready()
+                    return False
+
+                readable, _, _ = select.select(open_fds, [], [], remaining)
+                for fd in readable:
+                    data = os.read(fd, 4096)
+                    if not data:
+                        open_fds.remove(fd)
+                    elif fd == status_fd:
+                        status += data
+                    else:
+                        errors = (errors + data)[-8192:]
+
+            if status.startswith(b"READY"):
+                print('* Started %s' % self.name)
+                self._emit("start", self._start_origin, ok=True)
+                return True
+
+            # The daemon is going down, give it a moment to finish writing
+            # its traceback to stderr
+            drain_deadline = min(deadline, time.time() + 1)
+            while error_fd in open_fds and time.time() < drain_deadline:
+                readable, _, _ = select.select(
+                    [error_fd], [], [], drain_deadline - time.time())
+                if not readable:
+                    break
+                data = os.read(error_fd, 4096)
+                if not data:
+                    break
+                errors = (errors + data)[-8192:]
+
+            if status.startswith(b"EXIT"):
+                code = int(status.split()[1])
+                print('* %s exited during startup with code %s' % (self.name, code))
+                self._emit("start", self._start_origin, ok=False, reason="exit",
+                           exit_code=code)
+            else:
+                print('* %s died during startup' % self.name)
+                self._emit("start", self._start_origin, ok=False, reason="died")
+
+            lines = collections.deque(
+                errors.decode("utf-8", "replace").splitlines(), maxlen=10)
+            if lines:
+                print('* Last lines written to stderr:')
+                for line in lines:
+                    print('    %s' % line)
+            return False
+
+        def _report_exit(self, code):
+            """Tells the process which ran `start` that the daemon is exiting
+            before it became ready. Its stderr keeps going to that process, so
+            the traceback of whatever made it exit is shown there.
+
+            :param code: The exit code of the daemon
+            :type code: int
+            :returns: None
+            :rtype: None
+            """
+            if self._ready_fd is None:
+                return
+
+            # The start failed, without the PID file `_clean` won't restart
+            # a daemon which is bound to fail again
+            try:
+                os.remove(self.pid_file)
+            except OSError:
+                pass
+
+            self._release_launcher(("EXIT %d\n" % code).encode())
+
         def _stop(self):
             """Stops the service (if it's installed and running).
 
@@ -327,36 +1571,75 @@ def service(func):
             # and will restart the service if auto-start is enabled
             os.remove(self.pid_file)
 
-            # Attempt to kill the process, continue to attempt to kill it until
-            # the process has died with a maximum of 5 attempts
-            attempts = 0
+            return self._terminate(pid, self.stop_timeout)
+
+        def _kill_unready(self):
+            """Terminates a daemon which did not become ready in time, as
+            found in the PID file.
+
+            :returns: True when the daemon is gone and False otherwise.
+            :rtype: Boolean
+            """
             try:
+                with open(self.pid_file) as file:
+                    pid = int(file.read().strip())
+            except (IOError, OSError, ValueError):
+                print('* Unable to read PID file, %s may still be running' % self.name)
+                return False
 
-                while attempts < 5:
-                    os.kill(pid, signal.SIGTERM)
-                    time.sleep(0.2)
-                    attempts += 1
+            # Without the PID file the daemon doesn't restart itself
+            os.remove(self.pid_file)
+            print('* Stopping %s' % self.name)
+            return self._terminate(pid, 1)
 
-            except OSError as error:
-                error_message = str(error.args)
+        def _terminate(self, pid, timeout):
+            """Ends a daemon, escalating when it doesn't exit in time.
 
-                # Check the error message, if it contains the text below,
-                # the process is no longer running and we have thus killed the process
-                if error_message.find("No such process") > 0:
-                    return True
-                else:
-                    print("* Unable to kill the process %s" % error_message)
+            :param pid: The PID of the daemon
+            :param timeout: Seconds to wait after the first SIGTERM
+            :type pid: int
+            :type timeout: float
+            :returns: True when the daemon is gone and False otherwise.
+            :rtype: Boolean
+            """
+            # Ask the process to stop and give it `timeout` seconds to do
+            # so, after that a second SIGTERM makes it exit right away and
+            # SIGKILL is the last resort
+            for sig, timeout in ((signal.SIGTERM, timeout),
+                                 (signal.SIGTERM, 1),
+                                 (signal.SIGKILL, 1)):
+                try:
+                    os.kill(pid, sig)
+                except OSError as error:
+                    # The process is no longer running and we have thus killed the process
+                    if error.errno == errno.ESRCH:
+                        return True
+                    print("* Unable to kill the process %s" % str(error.args))
                     return False
 
+                deadline = time.time() + timeout
+                while time.time() < deadline:
+                    if not _is_alive(pid):
+                        return True
+                    time.sleep(0.1)
+
+                print("* %s did not stop within %ss" % (self.name, timeout))
+                self._emit("stop_escalate", signal=sig, timeout=timeout)
+
             # We were unable to kill the process due to an unknown reason
             print("* Unable to kill the process due to an unknown reason")
             return False
 
-        def _install(self, user):
+        def _install(self, user, bundle=False, isolated=False):
             """Installs the service so it can be started and stopped (if it's not installed yet).
 
             :param user: The user the service should run as
+            :param bundle: Whether to run the service from a precompiled bundle
+            :param isolated: Whether the bundle should only hold the modules
+                imported at install time
             :type user: str
+            :type bundle: bool
+            :type isolated: bool
             :returns: True when successful and False otherwise.
             :rtype: Boolean
             """
@@ -394,6 +1677,11 @@ def service(func):
             service_path = os.path.join(os.getcwd(), sys.argv[0])
             python_path = sys.executable
 
+            if bundle:
+                command = self._bundle(service_path, isolated)
+                python_path = ' '.join(command[:-1])
+                service_path = command[-1]
+
             # Replace the python path and the path to our service in the start script
             start_script = start_script.replace('%PYTHON_PATH%', python_path)
             start_script = start_script.replace('%SERVICE_PATH%', service_path)
@@ -427,8 +1715,38 @@ def service(func):
                 print("* Unable to uninstall, failed to remove control script: %s" % str(error))
                 return False
 
+            if os.path.isdir(self.bundle_directory):
+                shutil.rmtree(self.bundle_directory, ignore_errors=True)
+
             return True
 
+        def _bundle(self, service_path, isolated):
+            """Builds the bundle the service is run from, and reports how much
+            faster it starts than the plain script.
+
+            :param service_path: The path of the service script
+            :param isolated: Whether to leave out the fallback to the current `sys.path`
+            :type service_path: str
+            :type isolated: bool
+            :returns: The command which runs the bundled service
+            :rtype: list
+            """
+            from . import bundle
+
+            origin = time.monotonic()
+            command = bundle.build(service_path, self.bundle_directory, isolated)
+            self._emit("bundle", origin, isolated=isolated)
+
+            before = bundle.measure([sys.executable, service_path])
+            after = bundle.measure(command)
+            if before is None or after is None:
+                raise RuntimeError('The bundled service failed to start, '
+                                   'install without `--bundle`.')
+
+            print('* Bundled in %s' % self.bundle_directory)
+            print('* Cold start: %.1fms -> %.1fms' % (before * 1000, after * 1000))
+            return command
+
         def is_installed(self):
             """Determines whether this service is installed on this system.
 
@@ -464,6 +1782,7 @@ def service(func):
             # If the PID file still exists, we're dealing with abnormal program
             # termination and we'll restart ourselves if auto-start is enabled
             if os.path.exists(self.pid_file):
+                self._emit("restart", self._start_origin, reason="abnormal termination")
                 service_path = os.path.join(os.getcwd(), sys.argv[0])
                 os.remove(self.pid_file)
                 time.sleep(1)
@@ -490,4 +1809,75 @@ def service(func):
             """
             pass 
 
+        def under_pressure(self, level):
+            """If overridden, this function will be called when memory runs
+            short, with "moderate" or "critical" as the level, to shed caches
+            or reduce concurrency (see `trim_memory`). It runs on the thread
+            watching the pressure.
+            """
+            pass
+
+        def reconfigured(self, old, new):
+            """If overridden, this function will be called after the
+            configuration of the service was reloaded and changed, with the
+            previous and the new snapshot. It runs on the thread which
+            reloaded the configuration, `self.config` is already `new`.
+            """
+            pass
+
     return LinuxService()
+
+
+def host(name, *services, **options):
+    """Combines several services into a single service, which runs each of
+    them on its own thread within one daemon.
+
+    The hosted services can be started, stopped and restarted independently
+    with the `member` subcommand and show up by name in the `status` output.
+    An exception raised by one of them stops only that service.
+
+    :param name: The name of the combined service
+    :param services: The services to host, created with `service`
+    :param options: Options for the combined service, see `service`,
+        `graceful_stop` defaults to True as the hosted services are asked to
+        stop
+    :type name: str
+    :returns: The combined service
+    :rtype: pyservice.LinuxService
+    """
+    def body(self):
+        for member in self.members.values():
+            member.start()
+
+        while not self.stop_requested:
+            time.sleep(0.2)
+
+        # Ask all hosted services to stop at once, then wait for them with
+        # one deadline for the lot
+        deadline = time.time() + self.stop_timeout
+        for member in self.members.values():
+            if member.is_alive():
+                member.request_stop()
+        for member in self.members.values():
+            member.stop(max(deadline - time.time(), 0))
+
+    def hosted(member):
+        def run():
+            member.stop_requested = False
+            member.started_at = time.time()
+            try:
+                member._run_body()
+            finally:
+                member._shutdown()
+                member.stopped()
+        return run
+
+    body.__name__ = name
+    body.__doc__ = "Hosts %s" % ", ".join(member.name for member in services)
+
+    options.setdefault("graceful_stop", True)
+    supervisor = service(body, **options)
+    for member in services:
+        supervisor.members[member.name] = SupervisedThread(
+            member.name, hosted(member), member.request_stop, member)
+    return supervisor
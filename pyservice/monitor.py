@@ -0,0 +1,259 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+"""This module implements the latency monitor of Linux services, enabled with
+`service(monitor=True)` and available as `self.monitor`.
+
+It measures three things that make a service slow to respond:
+
+* Scheduling delay: a sentinel thread sleeps for a short interval and
+  records how much longer than that it took to run again, which is time
+  spent waiting for the GIL (or the CPU).
+* Event loop lag: for asyncio loops passed to `watch_loop`, how late a
+  callback scheduled on the loop runs.
+* Garbage collection pauses, through `gc.callbacks`.
+
+Each is kept in a histogram with fixed buckets, reported under `monitor` by
+the `status` subcommand. When a delay exceeds the alert threshold the stacks
+of the threads involved are appended to a file in the run directory, for a
+blocked event loop this is done while it is still blocked.
+"""
+import os
+import gc
+import sys
+import time
+import weakref
+import threading
+import traceback
+import collections
+
+# Upper bounds of the histogram buckets, in milliseconds
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+
+# Bytes after which the stack file is rotated
+MAX_STACK_BYTES = 256 * 1024
+
+
+class Histogram(object):
+    """Counts durations in fixed buckets.
+    """
+    def __init__(self):
+        """Initializes a new instance of pyservice.monitor.Histogram.
+        """
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        """Adds a duration to the histogram.
+
+        :param seconds: The duration
+        :type seconds: float
+        :returns: None
+        :rtype: None
+        """
+        milliseconds = seconds * 1000
+        index = 0
+        while index < len(BUCKETS) and milliseconds > BUCKETS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def stats(self):
+        """Describes the histogram.
+
+        :returns: The count, mean, max and the count of each bucket
+        :rtype: dict
+        """
+        count = sum(self.counts)
+        buckets = collections.OrderedDict()
+        for bound, value in zip(BUCKETS, self.counts):
+            buckets["<=%dms" % bound] = value
+        buckets[">%dms" % BUCKETS[-1]] = self.counts[-1]
+
+        info = collections.OrderedDict()
+        info["count"] = count
+        info["mean_ms"] = round(self.total / count * 1000, 3) if count else None
+        info["max_ms"] = round(self.max * 1000, 3)
+        info["buckets"] = buckets
+        return info
+
+
+class Monitor(object):
+    """Measures scheduling delay, event loop lag and GC pauses of a process.
+    """
+    def __init__(self, stack_file, threshold=0.1, interval=0.01):
+        """Initializes a new instance of pyservice.monitor.Monitor.
+
+        :param stack_file: Where to append stack snapshots
+        :param threshold: Seconds of delay after which a snapshot is taken
+        :param interval: Seconds the sentinel thread sleeps between samples
+        :type stack_file: str
+        :type threshold: float
+        :type interval: float
+        """
+        self.stack_file = stack_file
+        self.threshold = threshold
+        self.interval = interval
+        self.scheduling_delay = Histogram()
+        self.loop_lag = Histogram()
+        self.gc_pause = Histogram()
+        self.alerts = 0
+
+        self._loops = {}
+        self._gc_started = None
+        self._last_snapshot = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Starts the sentinel thread and hooks into the garbage collector.
+
+        :returns: None
+        :rtype: None
+        """
+        gc.callbacks.append(self._gc_callback)
+        self._thread = threading.Thread(target=self._sentinel, name="pyservice-monitor")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops monitoring.
+
+        :returns: None
+        :rtype: None
+        """
+        self._stop.set()
+        if self._gc_callback in gc.callbacks:
+            gc.callbacks.remove(self._gc_callback)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def watch_loop(self, loop):
+        """Measures the lag of an asyncio event loop, call this from any
+        thread once the loop exists.
+
+        :param loop: The event loop
+        :type loop: asyncio.AbstractEventLoop
+        :returns: None
+        :rtype: None
+        """
+        def probe(expected):
+            now = time.monotonic()
+            if expected is not None:
+                self.loop_lag.record(max(now - expected, 0))
+
+            # The sentinel thread checks the heartbeat, and snapshots the
+            # loop's thread if it stops beating
+            self._loops[id(loop)] = [threading.get_ident(), now, False, weakref.ref(loop)]
+            if not self._stop.is_set() and not loop.is_closed():
+                loop.call_later(self.interval, probe, now + self.interval)
+
+        loop.call_soon_threadsafe(probe, None)
+
+    def stats(self):
+        """Describes what was measured, this is reported under `monitor` by
+        `status`.
+
+        :returns: The histograms and the number of alerts
+        :rtype: dict
+        """
+        info = collections.OrderedDict()
+        info["scheduling_delay"] = self.scheduling_delay.stats()
+        if sum(self.loop_lag.counts) or self._loops:
+            info["loop_lag"] = self.loop_lag.stats()
+        info["gc_pause"] = self.gc_pause.stats()
+        info["alerts"] = self.alerts
+        return info
+
+    def _sentinel(self):
+        """Samples the scheduling delay and watches the event loops.
+        """
+        while not self._stop.is_set():
+            before = time.monotonic()
+            time.sleep(self.interval)
+            now = time.monotonic()
+
+            delay = max(now - before - self.interval, 0)
+            self.scheduling_delay.record(delay)
+            if delay > self.threshold:
+                self._snapshot("Scheduling delay of %.3fs" % delay)
+
+            for key, heartbeat in list(self._loops.items()):
+                ident, last, reported, reference = heartbeat
+                loop = reference()
+                if loop is None or loop.is_closed():
+                    del self._loops[key]
+                    continue
+                if not loop.is_running():
+                    continue
+                if not reported and now - last > self.threshold:
+                    heartbeat[2] = True
+                    self._snapshot("Event loop blocked for %.3fs" % (now - last), ident)
+
+    def _gc_callback(self, phase, info):
+        """Records the duration of garbage collections.
+
+        :param phase: "start" or "stop"
+        :param info: Details of the collection
+        """
+        if phase == "start":
+            self._gc_started = time.monotonic()
+        elif self._gc_started is not None:
+            self.gc_pause.record(time.monotonic() - self._gc_started)
+            self._gc_started = None
+
+    def _snapshot(self, reason, ident=None):
+        """Appends the stacks of the offending threads to the stack file, at
+        most once a second.
+
+        :param reason: Why the snapshot is taken
+        :param ident: The thread to snapshot, all other threads if None
+        :type reason: str
+        :type ident: int
+        """
+        self.alerts += 1
+        if time.monotonic() - self._last_snapshot < 1:
+            return
+        self._last_snapshot = time.monotonic()
+
+        lines = ["=== %s: %s\n" % (time.ctime(), reason)]
+        names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+        for thread_ident, frame in sys._current_frames().items():
+            if thread_ident == threading.get_ident():
+                continue
+            if ident is not None and thread_ident != ident:
+                continue
+            lines.append("--- %s\n" % names.get(thread_ident, thread_ident))
+            lines.extend(traceback.format_stack(frame))
+
+        try:
+            if os.path.getsize(self.stack_file) > MAX_STACK_BYTES:
+                os.rename(self.stack_file, self.stack_file + ".1")
+        except OSError:
+            pass
+
+        try:
+            with open(self.stack_file, "a") as file:
+                file.writelines(lines)
+        except (IOError, OSError):
+            pass
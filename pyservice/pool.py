@@ -0,0 +1,303 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+"""This module implements the process pool available to Linux services as
+`self.pool`.
+
+The pool is a thin layer over concurrent.futures.ProcessPoolExecutor which
+the service owns: it is created on first use inside the daemon, replaced
+when one of its workers dies or hangs past its timeout and shut down when
+the service stops. It also keeps the numbers reported under `pool` by the
+`status` subcommand.
+"""
+import os
+import time
+import signal
+import threading
+import collections
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from .utils import percentile
+
+
+def _reset_signals():
+    """Runs in every worker process, which are forked from the daemon and
+    would otherwise inherit its handler that turns SIGTERM into a stop
+    request instead of exiting.
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def _processes(executor):
+    """Lists the worker processes of an executor.
+
+    :param executor: The executor
+    :type executor: concurrent.futures.ProcessPoolExecutor
+    :rtype: list
+    """
+    return list((getattr(executor, "_processes", None) or {}).values())
+
+
+def _kill(processes):
+    """Kills the worker processes which are still alive.
+
+    :param processes: The worker processes
+    :type processes: list
+    """
+    for process in processes:
+        try:
+            if process.is_alive():
+                process.kill()
+        except Exception:
+            pass
+
+
+class ServicePool(object):
+    """A process pool tied to the lifecycle of a service.
+    """
+    def __init__(self, workers=None, timeout=None):
+        """Initializes a new instance of pyservice.pool.ServicePool.
+
+        :param workers: The number of worker processes, defaults to the
+            number of CPUs this process may run on
+        :param timeout: Default number of seconds `result` waits for a task
+        :type workers: int
+        :type timeout: float
+        """
+        if workers is None:
+            workers = len(os.sched_getaffinity(0))
+
+        self.workers = workers
+        self.timeout = timeout
+        self._executor = None
+        self._broken = False
+        self._closed = False
+        self._lock = threading.Lock()
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.restarts = 0
+        self._latencies = collections.deque(maxlen=1024)
+
+    def submit(self, fn, *args, **kwargs):
+        """Schedules `fn(*args, **kwargs)` to run in a worker process.
+
+        :param fn: The function to run, must be picklable
+        :type fn: callable
+        :returns: A future for the result
+        :rtype: concurrent.futures.Future
+        """
+        executor = self._get_executor()
+        try:
+            future = executor.submit(fn, *args, **kwargs)
+        except BrokenProcessPool:
+            # A worker died since we last looked, start over once
+            self._replace()
+            executor = self._get_executor()
+            future = executor.submit(fn, *args, **kwargs)
+
+        with self._lock:
+            self.submitted += 1
+        submitted_at = time.time()
+        future.add_done_callback(
+            lambda future: self._finished(future, executor, submitted_at))
+        return future
+
+    def result(self, future, timeout=None):
+        """Waits for the result of a task submitted to this pool.
+
+        A task which is still running when the timeout expires is killed by
+        replacing the pool's workers, which fails any other task running at
+        that moment with BrokenProcessPool.
+
+        :param future: The future returned by `submit`
+        :param timeout: Seconds to wait, defaults to the pool's timeout
+        :type future: concurrent.futures.Future
+        :type timeout: float
+        :returns: The result of the task
+        :raises concurrent.futures.TimeoutError: When the task did not finish in time
+        """
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            if not future.cancel():
+                self._replace()
+            raise
+
+    def run(self, fn, *args, **kwargs):
+        """Runs `fn(*args, **kwargs)` in a worker process and waits for the
+        result, for at most the pool's timeout.
+
+        :param fn: The function to run, must be picklable
+        :type fn: callable
+        :returns: The result of the function
+        """
+        return self.result(self.submit(fn, *args, **kwargs))
+
+    def map(self, fn, iterable, timeout=None):
+        """Runs `fn` for every item of `iterable` in the worker processes.
+
+        :param fn: The function to run, must be picklable
+        :param iterable: The arguments to call `fn` with
+        :param timeout: Seconds to wait for each result, defaults to the
+            pool's timeout
+        :type fn: callable
+        :type timeout: float
+        :returns: The results in the order of `iterable`
+        :rtype: list
+        """
+        futures = [self.submit(fn, item) for item in iterable]
+        return [self.result(future, timeout) for future in futures]
+
+    def shutdown(self, wait=True, timeout=None):
+        """Shuts the pool down, after this no more tasks can be submitted.
+        Tasks which have not started yet are cancelled.
+
+        :param wait: Whether to wait for running tasks to finish
+        :param timeout: Seconds to wait for running tasks, after which they
+            are killed, defaults to waiting forever
+        :type wait: bool
+        :type timeout: float
+        :returns: None
+        :rtype: None
+        """
+        with self._lock:
+            self._closed = True
+            broken, self._broken = self._broken, False
+            executor, self._executor = self._executor, None
+
+        if executor is None:
+            return
+        if broken:
+            # Its workers may be hung, waiting for them could take forever
+            self._discard(executor)
+            return
+
+        # The executor forgets its workers once it is shut down
+        processes = _processes(executor)
+        executor.shutdown(wait=False, cancel_futures=True)
+        if not wait:
+            return
+
+        # The workers exit once they are done with the tasks they run, the
+        # ones which don't make it in time are killed
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            for process in processes:
+                process.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+        finally:
+            _kill(processes)
+        executor.shutdown(wait=True)
+
+    def stats(self):
+        """Describes the pool, this is reported under `pool` by `status`.
+
+        :returns: Worker count, task counters, queue depth and latencies
+        :rtype: dict
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+            finished = self.completed + self.failed
+
+            info = collections.OrderedDict()
+            info["workers"] = self.workers
+            info["queue_depth"] = self.submitted - finished
+            info["submitted"] = self.submitted
+            info["completed"] = self.completed
+            info["failed"] = self.failed
+            info["timeouts"] = self.timeouts
+            info["restarts"] = self.restarts
+
+        for name, fraction in (("p50", 0.5), ("p99", 0.99), ("max", 1.0)):
+            value = percentile(latencies, fraction)
+            info["latency_%s_ms" % name] = None if value is None else round(value * 1000, 3)
+        return info
+
+    def _get_executor(self):
+        """Returns the executor, creating it (again) if needed.
+
+        :rtype: concurrent.futures.ProcessPoolExecutor
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The pool has been shut down")
+
+            if self._broken and self._executor is not None:
+                self._discard(self._executor)
+                self._executor = None
+                self.restarts += 1
+            self._broken = False
+
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     initializer=_reset_signals)
+            return self._executor
+
+    def _replace(self):
+        """Kills the workers of the executor right away, the next task gets
+        a new one.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self._broken = False
+            if executor is not None:
+                self.restarts += 1
+
+        if executor is not None:
+            self._discard(executor)
+
+    def _discard(self, executor):
+        """Kills the workers of an executor which is being replaced.
+
+        :param executor: The executor to get rid of
+        :type executor: concurrent.futures.ProcessPoolExecutor
+        """
+        # A hung worker would never pick up the shutdown request
+        _kill(_processes(executor))
+        executor.shutdown(wait=False)
+
+    def _finished(self, future, executor, submitted_at):
+        """Records the outcome of a task.
+
+        :param future: The future of the task
+        :param executor: The executor the task was submitted to
+        :param submitted_at: When the task was submitted
+        :type future: concurrent.futures.Future
+        :type executor: concurrent.futures.ProcessPoolExecutor
+        :type submitted_at: float
+        """
+        error = None if future.cancelled() else future.exception()
+        with self._lock:
+            self._latencies.append(time.time() - submitted_at)
+            if error is None and not future.cancelled():
+                self.completed += 1
+            else:
+                self.failed += 1
+
+            # The worker running this task died, the executor is unusable
+            # (unless it was replaced already)
+            if isinstance(error, BrokenProcessPool) and executor is self._executor:
+                self._broken = True
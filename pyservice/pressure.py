@@ -0,0 +1,349 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+"""This module tells Linux services when memory runs short, enabled with
+`service(memory_pressure=True)`, so they can shed caches before the kernel
+starts reclaiming or killing.
+
+Pressure is read from pressure stall information (PSI): the
+`memory.pressure` file of the cgroup of the service when there is one,
+`/proc/pressure/memory` otherwise. Triggers are registered on it, so the
+kernel wakes the watch when tasks have stalled on memory for a while, and
+when that is not permitted the averages are read periodically instead. On
+cgroup v2 the usage of the cgroup is compared to its `memory.high` limit
+as well. Either way pressure is reported at two levels:
+
+* moderate: some tasks stall on memory, or usage is close to the limit
+* critical: all tasks stall on memory, or usage has reached the limit
+
+`trim` is a helper for handling it: it runs the garbage collector and
+returns freed memory of the C allocator to the system.
+"""
+import os
+import gc
+import time
+import errno
+import select
+import ctypes
+import ctypes.util
+import threading
+import collections
+
+MODERATE = "moderate"
+CRITICAL = "critical"
+
+# Triggers as (line, level): microseconds of stall within a window of
+# microseconds. Unprivileged processes may only use windows which are a
+# multiple of two seconds.
+TRIGGERS = (
+    ("some 200000 2000000", MODERATE),
+    ("full 100000 2000000", CRITICAL),
+)
+
+# Averages over 10 seconds, in percent, used when triggers can't be used
+SOME_THRESHOLD = 10.0
+FULL_THRESHOLD = 5.0
+
+# Fractions of memory.high at which usage counts as moderate or critical
+HIGH_MODERATE = 0.9
+HIGH_CRITICAL = 1.0
+
+_libc = None
+
+
+def _cgroup_directory():
+    """Finds the cgroup v2 directory of this process.
+
+    :returns: The directory, or None when not on cgroup v2
+    :rtype: str
+    """
+    try:
+        with open("/proc/self/cgroup") as file:
+            for line in file:
+                if line.startswith("0::"):
+                    directory = "/sys/fs/cgroup" + line[3:].strip().rstrip("/")
+                    if os.path.exists(os.path.join(directory, "memory.current")):
+                        return directory
+    except (IOError, OSError):
+        pass
+    return None
+
+
+def _read_number(path):
+    """Reads a cgroup file holding a single number.
+
+    :param path: The file to read
+    :type path: str
+    :returns: The number, or None for "max" or when it can't be read
+    :rtype: int
+    """
+    try:
+        with open(path) as file:
+            value = file.read().strip()
+    except (IOError, OSError):
+        return None
+    return int(value) if value.isdigit() else None
+
+
+def _read_averages(path):
+    """Reads the 10 second averages of a PSI file.
+
+    :param path: The PSI file
+    :type path: str
+    :returns: Maps "some" and "full" to percentages
+    :rtype: dict
+    """
+    averages = {}
+    try:
+        with open(path) as file:
+            for line in file:
+                fields = line.split()
+                values = dict(field.split("=") for field in fields[1:])
+                averages[fields[0]] = float(values["avg10"])
+    except (IOError, OSError, ValueError, KeyError, IndexError):
+        pass
+    return averages
+
+
+def resident_bytes():
+    """Measures the resident memory of this process.
+
+    :returns: The number of bytes, or None if it can't be determined
+    :rtype: int
+    """
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
+def trim():
+    """Runs a full garbage collection and returns the memory the C
+    allocator has no use for to the system (glibc only).
+
+    :returns: The number of resident bytes reclaimed
+    :rtype: int
+    """
+    global _libc
+    before = resident_bytes()
+
+    gc.collect()
+    try:
+        if _libc is None:
+            _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6")
+        _libc.malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+    after = resident_bytes()
+    if before is None or after is None:
+        return 0
+    return max(before - after, 0)
+
+
+class PressureWatch(object):
+    """Watches memory pressure and calls back when there is any.
+    """
+    def __init__(self, callback, interval=2.0):
+        """Initializes a new instance of pyservice.pressure.PressureWatch.
+        The triggers are registered right away, do this before dropping
+        privileges.
+
+        :param callback: Called as `callback(level)` on the watch thread,
+            at most once per interval
+        :param interval: Seconds between checks of the cgroup usage and,
+            without triggers, of the averages
+        :type callback: callable
+        :type interval: float
+        """
+        self.callback = callback
+        self.interval = interval
+        self.events = collections.OrderedDict([(MODERATE, 0), (CRITICAL, 0)])
+        self.reclaimed = 0
+        self.last_level = None
+        self.last_event_at = None
+
+        self.cgroup = _cgroup_directory()
+        self.psi_file = "/proc/pressure/memory"
+        if self.cgroup is not None and os.path.exists(os.path.join(self.cgroup, "memory.pressure")):
+            self.psi_file = os.path.join(self.cgroup, "memory.pressure")
+
+        self._triggers = {}
+        for line, level in TRIGGERS:
+            try:
+                fd = os.open(self.psi_file, os.O_RDWR | os.O_NONBLOCK)
+            except OSError:
+                break
+            try:
+                os.write(fd, line.encode("ascii") + b"\0")
+            except OSError:
+                os.close(fd)
+                continue
+            self._triggers[fd] = level
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Starts the watch thread.
+
+        :returns: None
+        :rtype: None
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="pyservice-pressure")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops the watch thread. The triggers stay registered, so the watch
+        can be started again.
+
+        :returns: None
+        :rtype: None
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        """Stops watching and removes the triggers.
+
+        :returns: None
+        :rtype: None
+        """
+        self.stop()
+        for fd in list(self._triggers):
+            os.close(fd)
+        self._triggers.clear()
+
+    def level(self):
+        """Determines the current pressure level from the averages and the
+        usage of the cgroup.
+
+        :returns: CRITICAL, MODERATE or None
+        :rtype: str
+        """
+        usage = self._usage()
+        if usage is not None:
+            current, high = usage
+            if current >= high * HIGH_CRITICAL:
+                return CRITICAL
+            if current >= high * HIGH_MODERATE:
+                return MODERATE
+
+        # With triggers the kernel tells when the stalls matter
+        if self._triggers:
+            return None
+
+        averages = _read_averages(self.psi_file)
+        if averages.get("full", 0) >= FULL_THRESHOLD:
+            return CRITICAL
+        if averages.get("some", 0) >= SOME_THRESHOLD:
+            return MODERATE
+        return None
+
+    def stats(self):
+        """Describes the memory pressure, this is reported under `pressure` by
+        `status`.
+
+        :returns: The number of events per level, the bytes reclaimed by
+            handling them, the last level, the averages and the usage
+        :rtype: dict
+        """
+        info = collections.OrderedDict()
+        info["source"] = self.psi_file
+        info["triggers"] = bool(self._triggers)
+        info["events"] = collections.OrderedDict(self.events)
+        info["reclaimed"] = self.reclaimed
+        info["last_level"] = self.last_level
+        if self.last_event_at is not None:
+            info["since_last"] = round(time.time() - self.last_event_at, 3)
+        averages = _read_averages(self.psi_file)
+        info["some_avg10"] = averages.get("some")
+        info["full_avg10"] = averages.get("full")
+        usage = self._usage()
+        if usage is not None:
+            info["memory_current"], info["memory_high"] = usage
+        return info
+
+    def _usage(self):
+        """Reads the usage and the `memory.high` limit of the cgroup.
+
+        :returns: The usage and the limit in bytes, or None when there is no
+            limit
+        :rtype: tuple
+        """
+        if self.cgroup is None:
+            return None
+        high = _read_number(os.path.join(self.cgroup, "memory.high"))
+        current = _read_number(os.path.join(self.cgroup, "memory.current"))
+        if high is None or current is None:
+            return None
+        return current, high
+
+    def _watch(self):
+        """Waits for triggers to fire and checks the level every interval,
+        calling back when there is pressure.
+        """
+        poller = select.poll()
+        for fd in self._triggers:
+            poller.register(fd, select.POLLPRI)
+
+        next_event = 0
+        while not self._stop.is_set():
+            try:
+                fired = poller.poll(self.interval * 1000)
+            except (OSError, select.error) as error:
+                if getattr(error, "errno", None) == errno.EINTR:
+                    continue
+                raise
+
+            levels = [self.level()]
+            for fd, mask in fired:
+                if mask & select.POLLERR:
+                    # The PSI file went away with the cgroup
+                    poller.unregister(fd)
+                elif mask & select.POLLPRI:
+                    levels.append(self._triggers.get(fd))
+
+            level = CRITICAL if CRITICAL in levels else MODERATE if MODERATE in levels else None
+            if level is None or time.monotonic() < next_event or self._stop.is_set():
+                continue
+            next_event = time.monotonic() + self.interval
+            self._handle(level)
+
+    def _handle(self, level):
+        """Calls back for a pressure event, measuring what it reclaimed.
+
+        :param level: CRITICAL or MODERATE
+        :type level: str
+        """
+        self.events[level] += 1
+        self.last_level = level
+        self.last_event_at = time.time()
+
+        before = resident_bytes()
+        self.callback(level)
+        after = resident_bytes()
+        if before is not None and after is not None:
+            self.reclaimed += max(before - after, 0)
@@ -0,0 +1,189 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+"""This module implements the state snapshot available to Linux services as
+`self.state`.
+
+A service hands it a callable returning its warm state (caches, indexes)
+as bytes, which is then written to the run directory of the service
+periodically and when it stops. After a restart the snapshot is memory
+mapped, so the service can rebuild from it without reading it into memory
+first.
+
+Snapshots carry the version the service was created with (`state_version`),
+a snapshot written with any other version is discarded on load.
+"""
+import os
+import mmap
+import zlib
+import struct
+import threading
+
+# Magic, version, payload length and CRC32 of the payload
+HEADER = struct.Struct("<8sQQI")
+MAGIC = b"PYSVSTAT"
+
+
+class ServiceState(object):
+    """Snapshots the state of a service to a memory mapped file.
+    """
+    def __init__(self, path, version=0):
+        """Initializes a new instance of pyservice.state.ServiceState.
+
+        :param path: The file to keep the snapshot in
+        :param version: Version of the state format, snapshots with a
+            different version are discarded
+        :type path: str
+        :type version: int
+        """
+        self.path = path
+        self.version = version
+        self.provider = None
+        self.checkpoints = 0
+        self.last_checkpoint = None
+        self._map = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Maps the last snapshot into memory.
+
+        :returns: A read-only view of the snapshot, or None if there is no
+            compatible snapshot
+        :rtype: memoryview
+        """
+        try:
+            file = open(self.path, 'rb')
+        except (IOError, OSError):
+            return None
+
+        with file:
+            size = os.fstat(file.fileno()).st_size
+            if size < HEADER.size:
+                return self._discard()
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, length, checksum = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != self.version or HEADER.size + length != size:
+            return self._discard()
+
+        view = memoryview(self._map)[HEADER.size:]
+        if zlib.crc32(view) & 0xffffffff != checksum:
+            view.release()
+            return self._discard()
+        return view
+
+    def save(self, data):
+        """Writes a snapshot, replacing the previous one atomically.
+
+        :param data: The state to write
+        :type data: bytes-like
+        :returns: None
+        :rtype: None
+        """
+        data = memoryview(data).cast("B")
+        header = HEADER.pack(MAGIC, self.version, len(data),
+                             zlib.crc32(data) & 0xffffffff)
+
+        temporary = "%s.%d.tmp" % (self.path, os.getpid())
+        with self._lock:
+            with open(temporary, 'wb') as file:
+                file.write(header)
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            os.rename(temporary, self.path)
+
+    def checkpoint(self):
+        """Writes a snapshot of what the provider returns, if there is one.
+
+        :returns: True when a snapshot was written and False otherwise.
+        :rtype: Boolean
+        """
+        if self.provider is None:
+            return False
+
+        self.save(self.provider())
+        self.checkpoints += 1
+        self.last_checkpoint = os.path.getmtime(self.path)
+        return True
+
+    def persist(self, provider, interval=None):
+        """Registers the callable which returns the state to snapshot, it is
+        called every `interval` seconds and when the service stops.
+
+        :param provider: Callable returning the state as bytes
+        :param interval: Seconds between snapshots, only snapshot when the
+            service stops if None
+        :type provider: callable
+        :type interval: float
+        :returns: None
+        :rtype: None
+        """
+        self.provider = provider
+        if interval is None or self._thread is not None:
+            return
+
+        def run():
+            while not self._stop.wait(interval):
+                self.checkpoint()
+
+        self._thread = threading.Thread(target=run, name="pyservice-state")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        """Writes a final snapshot and stops the periodic ones.
+
+        :returns: None
+        :rtype: None
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.checkpoint()
+
+    def stats(self):
+        """Describes the snapshots, this is reported under `state` by `status`.
+
+        :returns: The version, number of checkpoints and time of the last one
+        :rtype: dict
+        """
+        return {
+            "version": self.version,
+            "checkpoints": self.checkpoints,
+            "last_checkpoint": self.last_checkpoint,
+        }
+
+    def _discard(self):
+        """Removes a snapshot which can not be used.
+
+        :returns: None
+        """
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+        return None
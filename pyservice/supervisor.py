@@ -0,0 +1,205 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+"""This module implements supervised threads for Linux services.
+
+A supervised thread runs a callable and keeps track of whether it is
+running, has stopped or has failed, so that a daemon can report on the
+things it runs and start, stop or restart them independently. An exception
+raised by the callable is recorded instead of taking down the process, and
+when the thread has a backoff the callable is run again after a delay which
+doubles with every consecutive failure.
+"""
+import sys
+import time
+import threading
+import traceback
+
+
+class SupervisedThread(object):
+    """Runs a callable on a thread which can be started, stopped and restarted.
+    """
+    def __init__(self, name, run, request_stop, service=None, backoff=None, max_backoff=60):
+        """Initializes a new instance of pyservice.supervisor.SupervisedThread.
+
+        :param name: The name to report this thread under
+        :param run: The callable to run on the thread
+        :param request_stop: Callable which asks `run` to return
+        :param service: The service run by this thread, if any
+        :param backoff: Seconds to wait before running `run` again after it
+            failed, None to leave the thread stopped instead
+        :param max_backoff: Seconds the delay doubles up to, a thread which
+            ran for longer than this before failing starts over with `backoff`
+        :type name: str
+        :type run: callable
+        :type request_stop: callable
+        :type service: pyservice.LinuxService
+        :type backoff: float
+        :type max_backoff: float
+        """
+        self.name = name
+        self.run = run
+        self.request_stop = request_stop
+        self.service = service
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.state = "stopped"
+        self.starts = 0
+        self.restarts = 0
+        self.started_at = None
+        self.last_error = None
+        self._thread = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+
+    def is_alive(self):
+        """Determines whether the thread is running.
+
+        :returns: True when the thread is running and False otherwise.
+        :rtype: Boolean
+        """
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Starts the thread unless it is already running.
+
+        :returns: True when the thread was started and False otherwise.
+        :rtype: Boolean
+        """
+        with self._lock:
+            if self.is_alive():
+                return False
+
+            self.state = "running"
+            self.starts += 1
+            self.started_at = time.time()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name=self.name)
+            self._thread.daemon = True
+            self._thread.start()
+            return True
+
+    def stop(self, timeout):
+        """Asks the thread to stop and waits for it to do so.
+
+        :param timeout: Seconds to wait for the thread to finish
+        :type timeout: float
+        :returns: True when the thread is no longer running and False otherwise.
+        :rtype: Boolean
+        """
+        if not self.is_alive():
+            return True
+
+        self._stopping.set()
+        self.request_stop()
+        self._thread.join(timeout)
+        return not self.is_alive()
+
+    def restart(self, timeout):
+        """Stops the thread (if it's running) and starts it again.
+
+        :param timeout: Seconds to wait for the thread to finish
+        :type timeout: float
+        :returns: True when the thread was restarted and False otherwise.
+        :rtype: Boolean
+        """
+        if not self.stop(timeout):
+            return False
+        return self.start()
+
+    def status(self):
+        """Describes the current state of the thread.
+
+        :returns: The state, uptime, number of starts, restarts after
+            failures, CPU time and last error
+        :rtype: dict
+        """
+        uptime = None
+        if self.is_alive():
+            uptime = round(time.time() - self.started_at, 3)
+
+        return {
+            "state": self.state,
+            "uptime": uptime,
+            "starts": self.starts,
+            "restarts": self.restarts,
+            "cpu_time": self.cpu_time(),
+            "last_error": self.last_error,
+        }
+
+    def cpu_time(self):
+        """Measures how much CPU time the thread has used, which for I/O
+        bound work is the time it was busy rather than waiting.
+
+        :returns: Seconds of CPU time, or None if the thread is not running
+            or the platform can't tell
+        :rtype: float
+        """
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return None
+        try:
+            return round(time.clock_gettime(time.pthread_getcpuclockid(thread.ident)), 3)
+        except (AttributeError, OSError):
+            return None
+
+    def _run(self):
+        """Runs the callable, and again after a delay whenever it fails if
+        the thread has a backoff.
+        """
+        delay = self.backoff
+        while True:
+            began = time.time()
+            if self._attempt() or not self.backoff or self._stopping.is_set():
+                return
+
+            if time.time() - began > self.max_backoff:
+                delay = self.backoff
+            self.state = "backoff"
+            if self._stopping.wait(delay):
+                self.state = "failed"
+                return
+
+            delay = min(delay * 2, self.max_backoff)
+            self.restarts += 1
+            self.started_at = time.time()
+            self.state = "running"
+
+    def _attempt(self):
+        """Runs the callable once, recording how it ended.
+
+        :returns: True when it returned and False when it failed
+        :rtype: Boolean
+        """
+        try:
+            self.run()
+            self.state = "stopped"
+            return True
+        except SystemExit as error:
+            self.state = "stopped" if not error.code else "failed"
+            if error.code:
+                self.last_error = "SystemExit(%r)" % (error.code, )
+            return not error.code
+        except BaseException as error:
+            self.state = "failed"
+            self.last_error = "%s: %s" % (type(error).__name__, error)
+            sys.stderr.write("* %s failed:\n" % self.name)
+            traceback.print_exc()
+            return False
@@ -0,0 +1,160 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+"""This module records the lifecycle of a Linux service.
+
+Every step of installing, starting and stopping a service is appended to a
+JSON lines file as an event with a wall clock and a monotonic timestamp.
+Events of a phase carry a `duration`, the number of seconds since the phase
+began: for the steps of starting up that is since `start` was run, for the
+steps of shutting down since the stop signal arrived. The monotonic clock
+is shared by all processes, so the launching process and the daemon can
+both contribute to the same phase.
+
+The file is rotated once it exceeds its maximum size, keeping one previous
+file, so it never takes more than twice that. Each service has its own log
+directory, handed to the user the service runs as so it can rotate the
+file after dropping privileges. The `history` subcommand
+summarizes it.
+"""
+import os
+import json
+import time
+import collections
+
+from .utils import percentile
+
+# Bytes after which the trace file is rotated
+MAX_BYTES = 1024 * 1024
+
+
+class Trace(object):
+    """Appends lifecycle events to a bounded JSON lines file.
+    """
+    def __init__(self, path, max_bytes=MAX_BYTES):
+        """Initializes a new instance of pyservice.trace.Trace.
+
+        :param path: The file to append events to
+        :param max_bytes: Size after which the file is rotated
+        :type path: str
+        :type max_bytes: int
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def emit(self, event, **fields):
+        """Appends an event to the trace. Failing to do so is ignored, the
+        trace must never get in the way of the service.
+
+        :param event: The name of the event
+        :param fields: Additional information about the event
+        :type event: str
+        :returns: None
+        :rtype: None
+        """
+        record = collections.OrderedDict()
+        record["time"] = round(time.time(), 6)
+        record["monotonic"] = round(time.monotonic(), 6)
+        record["pid"] = os.getpid()
+        record["event"] = event
+        for key, value in fields.items():
+            record[key] = round(value, 6) if isinstance(value, float) else value
+        line = (json.dumps(record) + "\n").encode("utf-8")
+
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+        if size + len(line) > self.max_bytes:
+            try:
+                os.rename(self.path, self.path + ".1")
+            except OSError:
+                # Rather lose events than let the trace grow without limit
+                return
+
+        try:
+            # A single write with O_APPEND keeps lines from the launching
+            # process and the daemon from interleaving
+            fd = self.open()
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+        except OSError:
+            pass
+
+    def open(self):
+        """Opens the trace file for appending, creating it (and the directory
+        it is in) if needed.
+
+        :returns: The file descriptor
+        :rtype: int
+        """
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o755)
+        return os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def read(self):
+        """Reads all events in the trace, oldest first.
+
+        :returns: The events
+        :rtype: list
+        """
+        events = []
+        for path in (self.path + ".1", self.path):
+            try:
+                file = open(path)
+            except (IOError, OSError):
+                continue
+            with file:
+                for line in file:
+                    try:
+                        events.append(json.loads(line))
+                    except ValueError:
+                        # A line cut short by a full disk or a crash
+                        continue
+        return events
+
+
+def summarize(events):
+    """Computes percentiles of the duration of each kind of event.
+
+    :param events: Events as returned by `Trace.read`
+    :type events: list
+    :returns: Maps event names to count, p50, p90, p99 and max duration
+    :rtype: collections.OrderedDict
+    """
+    durations = collections.OrderedDict()
+    for event in events:
+        if event.get("duration") is not None:
+            durations.setdefault(event["event"], []).append(event["duration"])
+
+    summary = collections.OrderedDict()
+    for name, values in durations.items():
+        values.sort()
+        summary[name] = collections.OrderedDict([
+            ("count", len(values)),
+            ("p50", percentile(values, 0.5)),
+            ("p90", percentile(values, 0.9)),
+            ("p99", percentile(values, 0.99)),
+            ("max", values[-1]),
+        ])
+    return summary
@@ -0,0 +1,54 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+"""This module holds helpers shared by the other modules of pyservice."""
+import os
+import socket
+
+
+def percentile(values, fraction):
+    """Picks a percentile from a sorted list (nearest rank).
+
+    :param values: The sorted values
+    :param fraction: The percentile as a fraction (0.99 for p99)
+    :type values: list
+    :type fraction: float
+    :returns: The value at the percentile or None if there are no values
+    """
+    if not values:
+        return None
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def bind_unix_socket(path):
+    """Creates a Unix socket bound to a path, which is not listening yet.
+
+    :param path: The path to bind to
+    :type path: str
+    :returns: The bound socket
+    :rtype: socket.socket
+    """
+    # A socket left behind by a previous instance would make bind fail
+    if os.path.exists(path):
+        os.remove(path)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    return sock
@@ -0,0 +1,312 @@
+######################################################################################
+#
+#   This file is part of PyService.
+#
+#   PyService is free software: you can redistribute it and/or modify it under the
+#   terms of the GNU General Public License as published by the Free Software
+#   Foundation, version 2.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#   FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+#   details.
+#
+#   You should have received a copy of the GNU General Public License along with
+#   this program; if not, write to the Free Software Foundation, Inc., 51
+#   Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   Copyright: Swen Kooij (Photonios) <photonios@outlook.com>
+#
+#####################################################################################
+"""This module watches files for Linux services with inotify, enabled with
+`service(watch=[...])` and consumed with `self.changes()`.
+
+A watched pattern is a path, of which the file name may contain glob
+wildcards (`/srv/incoming/*.csv`). The directory holding it is watched, so
+files which are replaced by renaming another file over them are seen too.
+
+Events are coalesced: once something changes, events keep being collected
+for a short window and the paths which changed during it are handed over
+as one batch. When the kernel's event queue overflows, events were lost and
+every file matching a pattern is reported instead.
+
+A watched directory which is removed is watched again once it is back,
+and the files in it which match are reported then.
+"""
+import os
+import errno
+import fnmatch
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+import collections
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# The events which mean a file in a watched directory changed
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_ONLYDIR)
+
+# struct inotify_event, followed by a name of `len` bytes
+EVENT = struct.Struct("iIII")
+
+_libc = None
+
+
+def _inotify():
+    """Loads the inotify functions of the C library.
+
+    :rtype: ctypes.CDLL
+    """
+    global _libc
+    if _libc is None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise RuntimeError("inotify is not available on this platform")
+        _libc = libc
+    return _libc
+
+
+def _split(pattern):
+    """Splits a pattern in the directory to watch and the file name pattern.
+
+    :param pattern: A path, of which the file name may contain wildcards
+    :type pattern: str
+    :rtype: tuple
+    """
+    directory, name = os.path.split(os.path.abspath(pattern))
+    if any(character in directory for character in "*?["):
+        raise RuntimeError("Only the file name of `%s` may contain wildcards" % pattern)
+    return directory, name
+
+
+class Watcher(object):
+    """Watches paths and glob patterns, and reports changes in batches.
+    """
+    def __init__(self, patterns=(), window=0.05):
+        """Initializes a new instance of pyservice.watch.Watcher.
+
+        :param patterns: Paths or glob patterns to watch
+        :param window: Seconds during which events are coalesced into one
+            batch, counted from the first event
+        :type patterns: list
+        :type window: float
+        """
+        self.window = window
+        self.events = 0
+        self.batches = 0
+        self.overflows = 0
+
+        # Maps watch descriptors to directories, and directories to the
+        # file name patterns watched in them
+        self._directories = {}
+        self._patterns = collections.OrderedDict()
+
+        # Directories which were removed while being watched
+        self._lost = set()
+
+        libc = _inotify()
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+
+        for pattern in patterns:
+            self.add(pattern)
+
+    def add(self, pattern):
+        """Starts watching a path or glob pattern.
+
+        :param pattern: A path, of which the file name may contain wildcards
+        :type pattern: str
+        :returns: None
+        :rtype: None
+        """
+        self._rewatch()
+
+        directory, name = _split(pattern)
+        if directory not in self._patterns:
+            code = self._watch(directory)
+            if code:
+                raise RuntimeError("Unable to watch `%s`: %s" % (directory, os.strerror(code)))
+            self._patterns[directory] = []
+        if name not in self._patterns[directory]:
+            self._patterns[directory].append(name)
+
+    def _watch(self, directory):
+        """Adds an inotify watch on a directory.
+
+        :param directory: The directory to watch
+        :type directory: str
+        :returns: 0 when successful and the error number otherwise
+        :rtype: int
+        """
+        wd = _libc.inotify_add_watch(self._fd, directory.encode("utf-8"), WATCH_MASK)
+        if wd < 0:
+            return ctypes.get_errno()
+        self._directories[wd] = directory
+        return 0
+
+    def _rewatch(self):
+        """Watches the removed directories which are back again.
+
+        :returns: The files in them which match a pattern
+        :rtype: list
+        """
+        restored = []
+        for directory in sorted(self._lost):
+            if self._watch(directory):
+                continue
+            self._lost.discard(directory)
+            try:
+                entries = os.listdir(directory)
+            except OSError:
+                continue
+            restored.extend(
+                os.path.join(directory, entry) for entry in entries
+                if any(fnmatch.fnmatchcase(entry, name) for name in self._patterns[directory]))
+        return restored
+
+    def fileno(self):
+        """The inotify file descriptor, readable when there are events.
+
+        :rtype: int
+        """
+        return self._fd
+
+    def matching(self):
+        """Lists the existing files which match any of the patterns.
+
+        :returns: The paths of the files
+        :rtype: list
+        """
+        paths = set()
+        for directory, names in self._patterns.items():
+            try:
+                entries = os.listdir(directory)
+            except OSError:
+                continue
+            for entry in entries:
+                if any(fnmatch.fnmatchcase(entry, name) for name in names):
+                    paths.add(os.path.join(directory, entry))
+        return sorted(paths)
+
+    def wait(self, timeout):
+        """Waits for changes and coalesces them into a batch.
+
+        :param timeout: Seconds to wait for the first event
+        :type timeout: float
+        :returns: The paths which changed, sorted, or an empty list when
+            nothing changed before the timeout
+        :rtype: list
+        """
+        restored = self._rewatch()
+        if restored:
+            self.batches += 1
+            return sorted(restored)
+
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+
+        changed = set()
+        overflow = self._read(changed)
+        deadline = time.monotonic() + self.window
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            readable, _, _ = select.select([self._fd], [], [], remaining)
+            if readable:
+                overflow = self._read(changed) or overflow
+
+        if overflow:
+            self.overflows += 1
+            changed.update(self.matching())
+        if changed:
+            self.batches += 1
+        return sorted(changed)
+
+    def _read(self, changed):
+        """Reads the pending events, adding the paths which match a pattern
+        to `changed`.
+
+        :param changed: The paths changed so far
+        :type changed: set
+        :returns: Whether the event queue overflowed
+        :rtype: Boolean
+        """
+        overflow = False
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except OSError as error:
+                if error.errno in (errno.EAGAIN, errno.EINTR):
+                    return overflow
+                raise
+
+            offset = 0
+            while offset + EVENT.size <= len(data):
+                wd, mask, _, length = EVENT.unpack_from(data, offset)
+                name = data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b"\0")
+                offset += EVENT.size + length
+                self.events += 1
+
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+
+                directory = self._directories.get(wd)
+                if mask & IN_IGNORED:
+                    # The directory is gone, watch it again once it is back
+                    if directory is not None:
+                        del self._directories[wd]
+                        self._lost.add(directory)
+                    continue
+                if directory is None or not name:
+                    continue
+
+                name = name.decode("utf-8", "surrogateescape")
+                if any(fnmatch.fnmatchcase(name, pattern)
+                       for pattern in self._patterns.get(directory, ())):
+                    changed.add(os.path.join(directory, name))
+
+    def close(self):
+        """Stops watching, closing the inotify file descriptor.
+
+        :returns: None
+        :rtype: None
+        """
+        fd, self._fd = self._fd, None
+        if fd is not None:
+            os.close(fd)
+
+    def stats(self):
+        """Describes what is watched, this is reported under `watch` by
+        `status`.
+
+        :returns: The watched patterns, the directories which are gone and
+            the number of events, batches and overflows
+        :rtype: dict
+        """
+        info = collections.OrderedDict()
+        info["patterns"] = [os.path.join(directory, name)
+                            for directory, names in self._patterns.items()
+                            for name in names]
+        info["lost"] = sorted(self._lost)
+        info["events"] = self.events
+        info["batches"] = self.batches
+        info["overflows"] = self.overflows
+        return info
@@ -45,12 +45,18 @@ handle_cli.__doc__ = """This is a thin wrapper around
 win32serviceutil.HandleCommandLine
 """
 
-def service(func):
+def service(func=None, **options):
     """decorator which will turn func into a windows service
+
+    Can be used either bare (`@service`) or with options, options which
+    only apply to Linux services are accepted and ignored so the same
+    decorated function works on both platforms.
     
     :param func: The function to turn into a windows service
     :type func: callable
     """
+    if func is None:
+        return lambda func: service(func, **options)
     
     @wraps(func)
     class WindowsService(win32serviceutil.ServiceFramework):
@@ -0,0 +1,126 @@
+"""Tests for pyservice.agent, against an agent listening on a local port."""
+import os
+import sys
+import socket
+import shutil
+import tempfile
+import textwrap
+import threading
+import unittest
+
+if sys.platform.startswith("linux"):
+    from pyservice import agent, control
+
+CONTROL_SCRIPT = textwrap.dedent("""\
+    #!/bin/bash
+    PYTHON_PATH="/usr/bin/python"
+    SERVICE_PATH="/srv/{name}.py"
+    sleep {delay}
+    echo "{name} $1"
+    """)
+
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "the agent runs on Linux")
+class AgentTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.init_directory = os.path.join(self.directory, "init.d")
+        self.run_directory = os.path.join(self.directory, "run")
+        os.makedirs(self.init_directory)
+        os.makedirs(self.run_directory)
+
+        # The later services answer sooner, so the results only come back
+        # in order if the agent puts them in order
+        for name, delay in (("first", 0.3), ("second", 0.2), ("third", 0)):
+            path = os.path.join(self.init_directory, name)
+            with open(path, "w") as file:
+                file.write(CONTROL_SCRIPT.format(name=name, delay=delay))
+            os.chmod(path, 0o755)
+        with open(os.path.join(self.init_directory, "unrelated"), "w") as file:
+            file.write("#!/bin/sh\n")
+
+        self.agent = agent.Agent("127.0.0.1:0", "secret", self.init_directory,
+                                 self.run_directory)
+        self.thread = threading.Thread(target=self.agent.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.assertTrue(self.agent.listening.wait(5))
+        self.address = "127.0.0.1:%d" % self.agent.bound_address[1]
+
+    def tearDown(self):
+        self.agent.close()
+        self.thread.join(5)
+        shutil.rmtree(self.directory)
+
+    def test_services(self):
+        self.assertEqual(self.agent.services(), ["first", "second", "third"])
+
+    def test_bad_token(self):
+        client = agent.AgentClient(self.address, "wrong", timeout=5)
+        with self.assertRaisesRegex(RuntimeError, "Authentication failed"):
+            client.run("status", "first")
+
+    def test_altered_batch(self):
+        sock = socket.create_connection(("127.0.0.1", self.agent.bound_address[1]), 5)
+        try:
+            nonce = control.read_message(sock)["nonce"]
+            signed = [{"service": "first", "op": "status"}]
+            control.send_message(sock, {"auth": agent._sign("secret", nonce, signed),
+                                        "requests": [{"service": "first", "op": "stop"}]})
+            reply = control.read_message(sock)
+        finally:
+            sock.close()
+        self.assertFalse(reply["ok"])
+        self.assertEqual(reply["error"], "Authentication failed")
+
+    def test_batch_order(self):
+        client = agent.AgentClient(self.address, "secret", timeout=10)
+        results = client.run("restart", "first", "second", "third")
+        self.assertEqual([result["service"] for result in results],
+                         ["first", "second", "third"])
+        self.assertTrue(all(result["ok"] for result in results))
+        self.assertEqual([result["result"] for result in results],
+                         ["first restart", "second restart", "third restart"])
+
+    def test_status(self):
+        with open(os.path.join(self.run_directory, "second.pid"), "w") as file:
+            file.write("1234\n")
+        client = agent.AgentClient(self.address, "secret", timeout=5)
+        first, second = client.run("status", "first", "second")
+        self.assertEqual(first["result"], {"running": False, "pid": None})
+        self.assertEqual(second["result"], {"running": True, "pid": 1234})
+
+    def test_unknown_service_and_operation(self):
+        client = agent.AgentClient(self.address, "secret", timeout=5)
+        missing, unrelated, bad_op = client.call([
+            {"service": "missing", "op": "start"},
+            {"service": "unrelated", "op": "start"},
+            {"service": "first", "op": "explode"},
+        ])
+        self.assertFalse(missing["ok"])
+        self.assertEqual(missing["error"], "Not installed")
+        self.assertFalse(unrelated["ok"])
+        self.assertEqual(unrelated["error"], "Not installed")
+        self.assertFalse(bad_op["ok"])
+        self.assertEqual(bad_op["error"], "Unknown operation: explode")
+
+    def test_fan_out(self):
+        results = agent.fan_out([self.address, "127.0.0.1:1"],
+                                [{"service": "third", "op": "start"}], "secret", timeout=5)
+        self.assertEqual(results[self.address][0]["result"], "third start")
+        self.assertIsInstance(results["127.0.0.1:1"], Exception)
+
+    def test_command_required(self):
+        with open(os.devnull, "w") as devnull:
+            stderr, sys.stderr = sys.stderr, devnull
+            try:
+                with self.assertRaises(SystemExit) as context:
+                    agent.main([])
+            finally:
+                sys.stderr = stderr
+        self.assertEqual(context.exception.code, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+"""Tests for pyservice.config, against files in a temporary directory."""
+import os
+import shutil
+import tempfile
+import textwrap
+import unittest
+
+from pyservice import config
+
+
+def positive_interval(path):
+    loaded = config.load_file(path)
+    if loaded.get("interval", 0) <= 0:
+        raise ValueError("interval must be positive")
+    return loaded
+
+
+class ServiceConfigTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as file:
+            file.write(content)
+        return path
+
+    def test_json(self):
+        path = self.write("service.json", '{"interval": 5, "hosts": ["a", "b"], "retry": {"max": 3}}')
+        snapshot = config.ServiceConfig(path).load()
+        self.assertEqual(snapshot["interval"], 5)
+        self.assertEqual(snapshot["hosts"], ("a", "b"))
+        self.assertEqual(snapshot["retry"]["max"], 3)
+
+    def test_ini(self):
+        path = self.write("service.ini", textwrap.dedent("""\
+            [server]
+            port = 8080
+            greeting = 100%
+            """))
+        snapshot = config.ServiceConfig(path).load()
+        self.assertEqual(dict(snapshot["server"]), {"port": "8080", "greeting": "100%"})
+
+    def test_snapshot_is_read_only(self):
+        path = self.write("service.json", '{"retry": {"max": 3}}')
+        snapshot = config.ServiceConfig(path).load()
+        with self.assertRaises(TypeError):
+            snapshot["interval"] = 1
+        with self.assertRaises(TypeError):
+            snapshot["retry"]["max"] = 1
+
+    def test_invalid_at_start(self):
+        path = self.write("service.json", '{"interval": 0}')
+        with self.assertRaisesRegex(RuntimeError, "interval must be positive"):
+            config.ServiceConfig(path, positive_interval).load()
+
+    def test_reload(self):
+        path = self.write("service.json", '{"interval": 5}')
+        service_config = config.ServiceConfig(path, positive_interval)
+        first = service_config.load()
+
+        self.write("service.json", '{"interval": 10}')
+        old, new = service_config.reload()
+        self.assertIs(old, first)
+        self.assertEqual(new["interval"], 10)
+        self.assertIs(service_config.snapshot, new)
+        self.assertEqual(service_config.stats()["reloads"], 1)
+
+    def test_rejected_reload_keeps_snapshot(self):
+        path = self.write("service.json", '{"interval": 5}')
+        service_config = config.ServiceConfig(path, positive_interval)
+        first = service_config.load()
+
+        for content in ('{"interval": 0}', '{"interval": '):
+            self.write("service.json", content)
+            with self.assertRaises(RuntimeError):
+                service_config.reload()
+            self.assertIs(service_config.snapshot, first)
+
+        stats = service_config.stats()
+        self.assertEqual(stats["reloads"], 0)
+        self.assertEqual(stats["rejected"], 2)
+        self.assertIn("Invalid configuration", stats["last_error"])
+
+        self.write("service.json", '{"interval": 10}')
+        service_config.reload()
+        self.assertEqual(service_config.snapshot["interval"], 10)
+        self.assertNotIn("last_error", service_config.stats())
+
+    def test_missing_file(self):
+        service_config = config.ServiceConfig(os.path.join(self.directory, "missing.json"))
+        with self.assertRaisesRegex(RuntimeError, "Invalid configuration"):
+            service_config.load()
+
+
+if __name__ == "__main__":
+    unittest.main()
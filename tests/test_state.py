@@ -0,0 +1,95 @@
+"""Tests for pyservice.state, against snapshots in a temporary directory."""
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyservice import state
+
+
+class ServiceStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "state")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def load(self, version=1):
+        snapshot = state.ServiceState(self.path, version)
+        view = snapshot.load()
+        self.addCleanup(snapshot._discard if view is None else view.release)
+        return view
+
+    def test_no_snapshot(self):
+        self.assertIsNone(self.load())
+
+    def test_round_trip(self):
+        state.ServiceState(self.path, 1).save(b"warm cache")
+        self.assertEqual(bytes(self.load()), b"warm cache")
+        self.assertEqual(os.listdir(self.directory), ["state"])
+
+    def test_empty_snapshot(self):
+        state.ServiceState(self.path, 1).save(b"")
+        self.assertEqual(bytes(self.load()), b"")
+
+    def test_other_version(self):
+        state.ServiceState(self.path, 1).save(b"warm cache")
+        self.assertIsNone(self.load(version=2))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_corrupted(self):
+        state.ServiceState(self.path, 1).save(b"warm cache")
+        with open(self.path, "r+b") as file:
+            file.seek(-1, os.SEEK_END)
+            file.write(b"X")
+        self.assertIsNone(self.load())
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_truncated(self):
+        state.ServiceState(self.path, 1).save(b"warm cache")
+        with open(self.path, "r+b") as file:
+            file.truncate(os.path.getsize(self.path) - 1)
+        self.assertIsNone(self.load())
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_shorter_than_header(self):
+        with open(self.path, "wb") as file:
+            file.write(state.MAGIC)
+        self.assertIsNone(self.load())
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_not_a_snapshot(self):
+        with open(self.path, "wb") as file:
+            file.write(b"\0" * 100)
+        self.assertIsNone(self.load())
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_checkpoint(self):
+        snapshot = state.ServiceState(self.path, 1)
+        self.assertFalse(snapshot.checkpoint())
+
+        snapshot.persist(lambda: b"first")
+        self.assertTrue(snapshot.checkpoint())
+        snapshot.persist(lambda: b"second")
+        snapshot.close()
+        self.assertEqual(snapshot.stats()["checkpoints"], 2)
+        self.assertEqual(bytes(self.load()), b"second")
+
+    def test_periodic_checkpoints(self):
+        snapshot = state.ServiceState(self.path, 1)
+        snapshot.persist(lambda: b"warm cache", interval=0.01)
+        try:
+            for _ in range(500):
+                if snapshot.checkpoints >= 2:
+                    break
+                snapshot._stop.wait(0.01)
+        finally:
+            snapshot.close()
+        self.assertGreaterEqual(snapshot.checkpoints, 3)
+        self.assertEqual(bytes(self.load()), b"warm cache")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+"""Tests for pyservice.supervisor, with callables standing in for services."""
+import io
+import sys
+import time
+import threading
+import unittest
+
+from pyservice import supervisor
+
+
+class SupervisedThreadTest(unittest.TestCase):
+
+    def setUp(self):
+        # Failures are written to stderr
+        self.stderr, sys.stderr = sys.stderr, io.StringIO()
+
+    def tearDown(self):
+        sys.stderr = self.stderr
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.time() + timeout
+        while not condition():
+            if time.time() > deadline:
+                self.fail("Timed out")
+            time.sleep(0.01)
+
+    def test_runs_until_stopped(self):
+        stop = threading.Event()
+        thread = supervisor.SupervisedThread("worker", stop.wait, stop.set)
+        self.assertTrue(thread.start())
+        self.assertFalse(thread.start())
+        self.assertEqual(thread.status()["state"], "running")
+
+        self.assertTrue(thread.stop(5))
+        self.assertEqual(thread.status()["state"], "stopped")
+        self.assertIsNone(thread.status()["uptime"])
+
+    def test_restart(self):
+        stop = threading.Event()
+
+        def run():
+            stop.wait()
+            stop.clear()
+
+        thread = supervisor.SupervisedThread("worker", run, stop.set)
+        thread.start()
+        self.assertTrue(thread.restart(5))
+        self.assertTrue(thread.is_alive())
+        self.assertEqual(thread.starts, 2)
+        thread.stop(5)
+
+    def test_failure_without_backoff(self):
+        def run():
+            raise ValueError("broken")
+
+        thread = supervisor.SupervisedThread("worker", run, lambda: None)
+        thread.start()
+        self.wait_for(lambda: not thread.is_alive())
+        self.assertEqual(thread.status()["state"], "failed")
+        self.assertEqual(thread.status()["last_error"], "ValueError: broken")
+        self.assertEqual(thread.restarts, 0)
+        self.assertIn("* worker failed:", sys.stderr.getvalue())
+
+    def test_backoff(self):
+        started = []
+
+        def run():
+            started.append(time.monotonic())
+            if len(started) < 4:
+                raise ValueError("broken")
+
+        thread = supervisor.SupervisedThread("worker", run, lambda: None,
+                                             backoff=0.05, max_backoff=0.15)
+        thread.start()
+        self.wait_for(lambda: not thread.is_alive())
+        self.assertEqual(thread.status()["state"], "stopped")
+        self.assertEqual(thread.restarts, 3)
+
+        # The delay doubles, up to the maximum
+        delays = [later - earlier for earlier, later in zip(started, started[1:])]
+        for delay, expected in zip(delays, (0.05, 0.1, 0.15)):
+            self.assertGreaterEqual(delay, expected)
+            self.assertLess(delay, expected + 1)
+
+    def test_stop_during_backoff(self):
+        def run():
+            raise ValueError("broken")
+
+        thread = supervisor.SupervisedThread("worker", run, lambda: None, backoff=60)
+        thread.start()
+        self.wait_for(lambda: thread.state == "backoff")
+        self.assertTrue(thread.stop(5))
+        self.assertEqual(thread.status()["state"], "failed")
+
+    def test_system_exit(self):
+        def run():
+            sys.exit(0)
+
+        thread = supervisor.SupervisedThread("worker", run, lambda: None, backoff=60)
+        thread.start()
+        self.wait_for(lambda: not thread.is_alive())
+        self.assertEqual(thread.status()["state"], "stopped")
+        self.assertIsNone(thread.status()["last_error"])
+
+
+if __name__ == "__main__":
+    unittest.main()
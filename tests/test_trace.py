@@ -0,0 +1,69 @@
+"""Tests for pyservice.trace, against a trace in a temporary directory."""
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyservice import trace
+
+
+class TraceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "service", "trace.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_emit_and_read(self):
+        lifecycle = trace.Trace(self.path)
+        lifecycle.emit("fork", duration=0.25)
+        lifecycle.emit("exit", exit_code=0)
+
+        events = lifecycle.read()
+        self.assertEqual([event["event"] for event in events], ["fork", "exit"])
+        self.assertEqual(events[0]["duration"], 0.25)
+        self.assertEqual(events[1]["exit_code"], 0)
+        self.assertEqual(events[1]["pid"], os.getpid())
+
+    def test_rotation(self):
+        lifecycle = trace.Trace(self.path, max_bytes=1000)
+        for index in range(100):
+            lifecycle.emit("ready", duration=0.1, index=index)
+
+        self.assertLessEqual(os.path.getsize(self.path), 1000)
+        self.assertLessEqual(os.path.getsize(self.path + ".1"), 1000)
+        indexes = [event["index"] for event in lifecycle.read()]
+        self.assertEqual(indexes, list(range(100 - len(indexes), 100)))
+
+    def test_line_cut_short(self):
+        lifecycle = trace.Trace(self.path)
+        lifecycle.emit("fork")
+        with open(self.path, "a") as file:
+            file.write('{"event": "ready", "dura')
+        self.assertEqual([event["event"] for event in lifecycle.read()], ["fork"])
+
+    def test_unwritable(self):
+        lifecycle = trace.Trace(os.path.join(self.directory, "file", "trace.jsonl"))
+        with open(os.path.join(self.directory, "file"), "w"):
+            pass
+        lifecycle.emit("fork")
+        self.assertEqual(lifecycle.read(), [])
+
+    def test_summarize(self):
+        events = [{"event": "ready", "duration": index / 100.0} for index in range(100, 0, -1)]
+        events.append({"event": "exit", "exit_code": 0})
+        events.append({"event": "stop", "duration": 2.0})
+
+        summary = trace.summarize(events)
+        self.assertEqual(list(summary), ["ready", "stop"])
+        self.assertEqual(summary["ready"]["count"], 100)
+        self.assertEqual(summary["ready"]["p50"], 0.51)
+        self.assertEqual(summary["ready"]["p99"], 1.0)
+        self.assertEqual(summary["ready"]["max"], 1.0)
+        self.assertEqual(summary["stop"]["p90"], 2.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
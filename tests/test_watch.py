@@ -0,0 +1,116 @@
+"""Tests for pyservice.watch, against temporary directories."""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+if sys.platform.startswith("linux"):
+    from pyservice import watch
+
+
+def touch(path):
+    with open(path, "w") as file:
+        file.write("data\n")
+
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "inotify is only available on Linux")
+class WatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.watcher = watch.Watcher([os.path.join(self.directory, "*.csv")], window=0.05)
+
+    def tearDown(self):
+        self.watcher.close()
+        shutil.rmtree(self.directory)
+
+    def path(self, *names):
+        return os.path.join(self.directory, *names)
+
+    def feed(self):
+        # Have the watcher read raw events from a pipe instead of the kernel
+        read_end, write_end = os.pipe()
+        os.set_blocking(read_end, False)
+        os.close(self.watcher._fd)
+        self.watcher._fd = read_end
+        self.addCleanup(os.close, write_end)
+        return write_end
+
+    def test_nothing_changed(self):
+        self.assertEqual(self.watcher.wait(0.1), [])
+
+    def test_matching_files(self):
+        touch(self.path("a.csv"))
+        touch(self.path("b.txt"))
+        self.assertEqual(self.watcher.wait(5), [self.path("a.csv")])
+
+    def test_changes_are_coalesced(self):
+        for name in ("a.csv", "b.csv", "c.csv"):
+            touch(self.path(name))
+        os.remove(self.path("b.csv"))
+        self.assertEqual(self.watcher.wait(5),
+                         [self.path("a.csv"), self.path("b.csv"), self.path("c.csv")])
+        self.assertEqual(self.watcher.batches, 1)
+
+    def test_renamed_over(self):
+        touch(self.path("a.csv"))
+        self.watcher.wait(5)
+        touch(self.path("new.tmp"))
+        os.rename(self.path("new.tmp"), self.path("a.csv"))
+        self.assertEqual(self.watcher.wait(5), [self.path("a.csv")])
+
+    def test_matching(self):
+        touch(self.path("a.csv"))
+        touch(self.path("b.txt"))
+        self.assertEqual(self.watcher.matching(), [self.path("a.csv")])
+
+    def test_wildcards_in_directory(self):
+        with self.assertRaisesRegex(RuntimeError, "may contain wildcards"):
+            self.watcher.add(self.path("*", "a.csv"))
+
+    def test_missing_directory(self):
+        with self.assertRaisesRegex(RuntimeError, "Unable to watch"):
+            self.watcher.add(self.path("missing", "a.csv"))
+
+    def test_removed_directory(self):
+        os.makedirs(self.path("sub"))
+        self.watcher.add(self.path("sub", "*.txt"))
+
+        shutil.rmtree(self.path("sub"))
+        self.assertEqual(self.watcher.wait(5), [])
+        self.assertEqual(self.watcher.stats()["lost"], [self.path("sub")])
+
+        os.makedirs(self.path("sub"))
+        touch(self.path("sub", "a.txt"))
+        touch(self.path("sub", "b.csv"))
+        self.assertEqual(self.watcher.wait(5), [self.path("sub", "a.txt")])
+        self.assertEqual(self.watcher.stats()["lost"], [])
+
+        touch(self.path("sub", "c.txt"))
+        self.assertEqual(self.watcher.wait(5), [self.path("sub", "c.txt")])
+
+    def test_events(self):
+        write_end = self.feed()
+
+        wd = list(self.watcher._directories)[0]
+        name = b"a.csv".ljust(16, b"\0")
+        os.write(write_end, watch.EVENT.pack(wd, watch.IN_CREATE, 0, len(name)) + name)
+        os.write(write_end, watch.EVENT.pack(wd, watch.IN_CREATE, 0, 0))
+        os.write(write_end, watch.EVENT.pack(wd + 1, watch.IN_CREATE, 0, len(name)) + name)
+        self.assertEqual(self.watcher.wait(5), [self.path("a.csv")])
+        self.assertEqual(self.watcher.events, 3)
+
+    def test_overflow(self):
+        touch(self.path("a.csv"))
+        touch(self.path("b.csv"))
+
+        write_end = self.feed()
+
+        os.write(write_end, watch.EVENT.pack(-1, watch.IN_Q_OVERFLOW, 0, 0))
+        self.assertEqual(self.watcher.wait(5), [self.path("a.csv"), self.path("b.csv")])
+        self.assertEqual(self.watcher.stats()["overflows"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()